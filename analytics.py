@@ -0,0 +1,210 @@
+import json
+import math
+import os
+from collections import deque
+
+from store import SnapshotStore
+
+# --------------------------
+# 增量分析
+# --------------------------
+# 在快照历史上维护每个指数的运行状态：滚动收益、回撤、估值结果的 z 分数，以及跨指数排名。
+# 状态连同快照存储的读取偏移一起保存在 JSON 文件中，每次只读取新追加的快照，
+# 每个快照对每个指数的更新为 O(1)；快照存储被整体改写（rescore 子命令、导入）时自动从头重算。
+
+# 滚动收益的窗口，按快照个数计（每周两次运行时约为一次、一月、一季、一年）
+return_windows = (1, 8, 26, 104)
+
+class PriceStats:
+    """单个指数的点位状态：最近 max(return_windows)+1 个点位、历史最高点与最大回撤"""
+    __slots__ = ("window", "peak", "max_drawdown")
+
+    def __init__(self, window=(), peak=None, max_drawdown=0.0):
+        self.window = deque(window, maxlen=max(return_windows) + 1)
+        self.peak = peak
+        self.max_drawdown = max_drawdown
+
+    def update(self, price):
+        if price is None or price <= 0:
+            return
+        self.window.append(price)
+        self.peak = price if self.peak is None else max(self.peak, price)
+        self.max_drawdown = min(self.max_drawdown, self.drawdown())
+
+    def last(self):
+        return self.window[-1] if self.window else None
+
+    def period_return(self, n):
+        """最近 n 个快照的收益率（%），历史不足时为 None"""
+        if len(self.window) <= n:
+            return None
+        return (self.window[-1] / self.window[-1 - n] - 1) * 100
+
+    def drawdown(self):
+        """当前点位相对历史最高点的回撤（%，非正）"""
+        if not self.window:
+            return None
+        return (self.window[-1] / self.peak - 1) * 100
+
+    def to_state(self):
+        return {"window": list(self.window), "peak": self.peak, "max_drawdown": self.max_drawdown}
+
+class ScoreStats:
+    """单个指数估值结果的运行均值与方差（Welford 算法）"""
+    __slots__ = ("count", "mean", "m2", "last")
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, last=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.last = last
+
+    def update(self, score):
+        if score is None:
+            return
+        self.count += 1
+        delta = score - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (score - self.mean)
+        self.last = score
+
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+
+    def zscore(self):
+        std = self.std()
+        if self.last is None or not std:
+            return None
+        return (self.last - self.mean) / std
+
+    def to_state(self):
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "last": self.last}
+
+class Analytics:
+    """
+    price_names / score_names: 需要统计的行情指数与估值指数名称；
+    快照中的键为 (名称, price_metric) 与 (名称, score_metric)。
+    """
+
+    def __init__(self, price_names, score_names, price_metric="price", score_metric="score"):
+        self.price_names = list(price_names)
+        self.score_names = list(score_names)
+        self.price_metric = price_metric
+        self.score_metric = score_metric
+        self.prices = {name: PriceStats() for name in self.price_names}
+        self.scores = {name: ScoreStats() for name in self.score_names}
+        self.snapshots = 0
+        self.last_date = None
+        # 已读取到的快照存储位置：下一行组的偏移，以及最后一个行组的起始偏移与 (date, time)
+        self.offset = None
+        self.last_group = None
+
+    def update(self, date, values):
+        for name, stats in self.prices.items():
+            stats.update(values.get((name, self.price_metric)))
+        for name, stats in self.scores.items():
+            stats.update(values.get((name, self.score_metric)))
+        self.snapshots += 1
+        self.last_date = date
+
+    # ---------- 结果表 ----------
+    def price_rows(self):
+        rows = []
+        for name, stats in self.prices.items():
+            rows.append([name, stats.last(), *(stats.period_return(n) for n in return_windows), stats.drawdown(), stats.max_drawdown])
+        return rows
+
+    def score_rows(self):
+        return [[name, s.last, s.mean if s.count else None, s.std(), s.zscore(), s.count] for name, s in self.scores.items()]
+
+    def rank_rows(self):
+        """
+        排名表：每列是一个指标，第 i 行是该指标第 i 名的指数名称。
+        收益从高到低，回撤从浅到深，估值结果与 z 分数从低到高（越低越便宜）。
+        """
+        columns = []
+        for n in return_windows:
+            columns.append(rank_names({name: s.period_return(n) for name, s in self.prices.items()}, reverse=True))
+        columns.append(rank_names({name: s.drawdown() for name, s in self.prices.items()}, reverse=True))
+        columns.append(rank_names({name: s.last for name, s in self.scores.items()}))
+        columns.append(rank_names({name: s.zscore() for name, s in self.scores.items()}))
+        depth = max((len(c) for c in columns), default=0)
+        return [[i + 1, *(c[i] if i < len(c) else None for c in columns)] for i in range(depth)]
+
+    def sheets(self):
+        """[(表名, 表头, 行), ...]"""
+        windows = [f"{n}次收益%" for n in return_windows]
+        return [
+            ("收益与回撤", ["名称", "点位", *windows, "回撤%", "最大回撤%"], self.price_rows()),
+            ("估值z分数", ["名称", "估值结果", "均值", "标准差", "z分数", "样本数"], self.score_rows()),
+            ("排名", ["名次", *windows, "回撤", "估值结果", "z分数"], self.rank_rows()),
+        ]
+
+    # ---------- 状态 ----------
+    def to_state(self):
+        return {
+            "snapshots": self.snapshots,
+            "last_date": self.last_date,
+            "offset": self.offset,
+            "last_group": self.last_group,
+            "prices": {name: s.to_state() for name, s in self.prices.items()},
+            "scores": {name: s.to_state() for name, s in self.scores.items()},
+        }
+
+    def load_state(self, state):
+        self.snapshots = state["snapshots"]
+        self.last_date = state["last_date"]
+        self.offset = state["offset"]
+        self.last_group = state["last_group"]
+        for name, s in state["prices"].items():
+            if name in self.prices:
+                self.prices[name] = PriceStats(**s)
+        for name, s in state["scores"].items():
+            if name in self.scores:
+                self.scores[name] = ScoreStats(**s)
+
+def rank_names(metric_by_name, reverse=False):
+    ranked = [(value, name) for name, value in metric_by_name.items() if value is not None]
+    ranked.sort(key=lambda item: item[0], reverse=reverse)
+    return [name for _, name in ranked]
+
+def state_matches(store, analytics):
+    """保存的偏移处仍是上次最后读取的那个快照，说明存储只被追加过"""
+    if analytics.offset is None or analytics.last_group is None:
+        return False
+    start, date, time = analytics.last_group
+    for group_start, _, (group_date, group_time, _) in store.scan(start):
+        return group_start == start and group_date == date and group_time == time
+    return False
+
+def update_analytics(store_path, state_path, price_names, score_names, price_metric="price", score_metric="score",
+                     seed_scores=None):
+    """
+    读取状态文件，只处理之后追加的快照，写回状态并返回 (Analytics, 本次处理的快照数)。
+    seed_scores() 返回 {名称: [估值结果, ...]}（回填的更早历史），只在从头重算时调用并先计入估值统计；
+    回填数据变化后调用方应删除状态文件。
+    """
+    store = SnapshotStore(store_path)
+    analytics = Analytics(price_names, score_names, price_metric, score_metric)
+    if os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as f:
+            analytics.load_state(json.load(f))
+        if not state_matches(store, analytics):
+            # 存储被改写或状态失效：从头重算
+            analytics = Analytics(price_names, score_names, price_metric, score_metric)
+    if analytics.offset is None and seed_scores:
+        for name, scores in seed_scores().items():
+            if name in analytics.scores:
+                for score in scores:
+                    analytics.scores[name].update(score)
+    processed = 0
+    for start, end, (date, time, values) in store.scan(analytics.offset):
+        analytics.update(date, values)
+        analytics.offset = end
+        analytics.last_group = [start, date, time]
+        processed += 1
+    tmp = state_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(analytics.to_state(), f, ensure_ascii=False)
+    os.replace(tmp, state_path)
+    return analytics, processed
@@ -0,0 +1,224 @@
+import asyncio
+import ssl
+import threading
+import zlib
+from urllib.parse import urlsplit
+
+# --------------------------
+# 轻量 HTTP 客户端
+# --------------------------
+# 基于 asyncio streams 的 HTTP/1.1 客户端，只依赖标准库。
+# 事件循环运行在后台线程中，抓取线程通过 request() 同步调用；
+# 连接按 (scheme, host, port) 放入连接池保持长连接，响应体按字节读取，
+# 只做 gzip / deflate 解压，按 Content-Type 中的 charset（缺省为 default_encoding）解码。
+class HTTPError(Exception):
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+class Headers(dict):
+    """键统一为小写的响应头"""
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key.lower(), value)
+
+    def __getitem__(self, key):
+        return super().__getitem__(key.lower())
+
+    def __contains__(self, key):
+        return super().__contains__(key.lower())
+
+    def get(self, key, default=None):
+        return super().get(key.lower(), default)
+
+class Response:
+    """与抓取引擎用到的 requests.Response 接口一致：status_code、ok、content、text、encoding、headers"""
+
+    def __init__(self, status_code, reason, headers, content, url, default_encoding="utf-8"):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.url = url
+        self.encoding = charset(headers.get("content-type", "")) or default_encoding
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HTTPError(f"{self.status_code} {self.reason} for url: {self.url}", response=self)
+
+def charset(content_type):
+    for part in content_type.split(";")[1:]:
+        key, _, value = part.strip().partition("=")
+        if key.lower() == "charset" and value:
+            return value.strip('"').lower()
+    return None
+
+def decompress(content, encoding):
+    encoding = (encoding or "").lower()
+    if encoding == "gzip":
+        return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(content)
+        except zlib.error:
+            return zlib.decompress(content, -zlib.MAX_WBITS)
+    return content
+
+async def read_body(reader, headers):
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                # 跳过 trailer
+                while (await reader.readuntil(b"\r\n")) != b"\r\n":
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+    if "content-length" in headers:
+        return await reader.readexactly(int(headers["content-length"]))
+    return await reader.read()
+
+async def read_response(reader):
+    """返回 (status_code, reason, headers, 原始响应体, 能否复用连接)"""
+    status_line = (await reader.readuntil(b"\r\n")).decode("latin-1").rstrip("\r\n")
+    version, _, rest = status_line.partition(" ")
+    code, _, reason = rest.partition(" ")
+    headers = Headers()
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        if line == b"\r\n":
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip()] = value.strip()
+    status_code = int(code)
+    if status_code in (204, 304) or 100 <= status_code < 200:
+        body = b""
+    else:
+        body = await read_body(reader, headers)
+    connection = headers.get("connection", "").lower()
+    reusable = version == "HTTP/1.1" and connection != "close" and (
+        "content-length" in headers or "transfer-encoding" in headers or not body
+    )
+    return status_code, reason, headers, body, reusable
+
+class AsyncHTTPClient:
+    """
+    线程安全的同步入口 request()，内部在专用事件循环上执行。
+    每个主机最多 max_per_host 个连接，空闲连接留在池中供后续请求复用。
+    """
+
+    def __init__(self, max_per_host=8, timeout=10):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.ssl_context = ssl.create_default_context()
+        self.idle = {}
+        self.limits = {}
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name="asynchttp", daemon=True)
+                self.thread.start()
+        return self
+
+    def request(self, method, url, headers=None, data=None, timeout=None, default_encoding="utf-8"):
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(
+            self.fetch(method, url, headers or {}, data, timeout or self.timeout, default_encoding), self.loop)
+        return future.result()
+
+    async def fetch(self, method, url, headers, body, timeout, default_encoding):
+        parts = urlsplit(url)
+        secure = parts.scheme == "https"
+        key = (parts.scheme, parts.hostname, parts.port or (443 if secure else 80))
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        lines = [f"{method} {target} HTTP/1.1"]
+        sent = {k.lower() for k in headers}
+        if "host" not in sent:
+            lines.append(f"Host: {parts.netloc}")
+        lines.extend(f"{k}: {v}" for k, v in headers.items() if k.lower() not in ("content-length", "connection"))
+        lines.append("Connection: keep-alive")
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b"")
+
+        limit = self.limits.setdefault(key, asyncio.Semaphore(self.max_per_host))
+        async with limit:
+            try:
+                status_code, reason, response_headers, content, reusable = await asyncio.wait_for(
+                    self.exchange(key, secure, payload), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"请求超时: {url}") from None
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+                raise ConnectionError(f"连接失败: {url}: {e!r}") from e
+        content = decompress(content, response_headers.get("content-encoding"))
+        return Response(status_code, reason, response_headers, content, url, default_encoding)
+
+    async def exchange(self, key, secure, payload):
+        # 复用的空闲连接可能已被服务端关闭，失败时换新连接重发一次
+        for reused in (True, False):
+            conn = self.checkout(key) if reused else None
+            if reused and conn is None:
+                continue
+            if conn is None:
+                conn = await asyncio.open_connection(
+                    key[1], key[2], ssl=self.ssl_context if secure else None,
+                    server_hostname=key[1] if secure else None)
+            reader, writer = conn
+            try:
+                writer.write(payload)
+                await writer.drain()
+                result = await read_response(reader)
+            except (OSError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if result[4]:
+                self.idle.setdefault(key, []).append(conn)
+            else:
+                writer.close()
+            return result
+
+    def checkout(self, key):
+        pool = self.idle.get(key)
+        while pool:
+            reader, writer = pool.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None
+
+    def close(self):
+        if self.loop is None:
+            return
+
+        async def close_all():
+            for pool in self.idle.values():
+                for _, writer in pool:
+                    writer.close()
+            self.idle.clear()
+        asyncio.run_coroutine_threadsafe(close_all(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import timeit
+
+import main
+from providers import get_provider
+from replay import StubServer, StubTransport, build_response, iter_fixtures
+
+# --------------------------
+# 基准测试
+# --------------------------
+# 先用 `python main.py --record fixtures` 录制一次真实响应，之后即可离线运行：
+#   python bench.py parsers --fixtures fixtures
+#   python bench.py e2e --fixtures fixtures --latency 0.05 --error-rate 0.05
+# tests/fixtures 中提交了各数据源的少量手写响应，可直接用于 parsers；e2e 需要覆盖全部指数的录制。
+default_fixture_dir = os.path.join(main.base_dir, "fixtures")
+
+def bench_parsers(fixture_dir):
+    """逐个夹具测量 provider.parse 的耗时，按数据源汇总"""
+    per_provider = {}
+    for fixture in iter_fixtures(fixture_dir):
+        if fixture["status"] != 200:
+            continue
+        provider = get_provider(fixture["provider"])
+        # 与抓取引擎一致，直接解析响应体 bytes
+        content = build_response(fixture).content
+        symbols = fixture["symbols"]
+        timer = timeit.Timer(lambda: provider.parse(content, symbols))
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=5, number=number)) / number
+        stats = per_provider.setdefault(provider.name, {"fixtures": 0, "symbols": 0, "bytes": 0, "seconds": 0.0})
+        stats["fixtures"] += 1
+        stats["symbols"] += len(symbols)
+        stats["bytes"] += len(fixture["body"])
+        stats["seconds"] += best
+    for stats in per_provider.values():
+        stats["us_per_symbol"] = round(stats["seconds"] / stats["symbols"] * 1e6, 3)
+        stats["seconds"] = round(stats["seconds"], 9)
+    return per_provider
+
+def bench_e2e(fixture_dir, runs=3, latency=0.0, error_rate=0.0, seed=0, client="requests"):
+    """
+    在临时目录中对 export_realtime_data 做端到端计时：请求经 requests 会话（client="requests"）
+    或 asynchttp 客户端（client="asyncio"）发往本地桩服务器，
+    工作簿与快照存储使用仓库当前文件的副本，全部数据文件（含派生的矩阵等）都写在临时目录，不使用响应缓存。
+    """
+    server = StubServer(fixture_dir, latency=latency, error_rate=error_rate, seed=seed).start()
+    saved = (main.transport, main.data_dir)
+    sources = (main.xlsx_path, main.store_path)
+    tmp = tempfile.mkdtemp(prefix="stocks-bench-")
+    timings = []
+    try:
+        main.transport = StubTransport(main.get_session() if client == "requests" else main.get_http_client(), server.url)
+        main.set_data_dir(tmp)
+        for source, target in zip(sources, (main.xlsx_path, main.store_path)):
+            if os.path.exists(source):
+                shutil.copy(source, target)
+        for _ in range(runs):
+            main.run_metrics.reset()
+            start = time.perf_counter()
+            # 夹具每次返回相同的数值，不强制写入时第 2 次起会被判为重复快照而提前返回
+            main.export_realtime_data(use_cache=False, force=True)
+            timings.append(time.perf_counter() - start)
+    finally:
+        main.transport = saved[0]
+        main.set_data_dir(saved[1])
+        server.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {
+        "runs": runs,
+        "client": client,
+        "latency": latency,
+        "error_rate": error_rate,
+        "requests": server.requests,
+        "min_seconds": round(min(timings), 4),
+        "median_seconds": round(statistics.median(timings), 4),
+        "max_seconds": round(max(timings), 4),
+        # 最后一次运行的分阶段耗时与各数据源请求统计
+        "last_run": main.run_metrics.report(),
+    }
+
+if __name__ == "__main__":
+    # 公共选项放在各子命令上，写在子命令之后
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--fixtures", default=default_fixture_dir, help="夹具目录")
+    common.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    parser = argparse.ArgumentParser(description="基于录制夹具的离线基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("parsers", parents=[common], help="单独测量各数据源解析器")
+    e2e = sub.add_parser("e2e", parents=[common], help="端到端测量 export_realtime_data")
+    e2e.add_argument("--runs", type=int, default=3)
+    e2e.add_argument("--latency", type=float, default=0.0, help="桩服务器每个请求的延迟（秒）")
+    e2e.add_argument("--error-rate", type=float, default=0.0, help="桩服务器返回 503 的概率")
+    e2e.add_argument("--seed", type=int, default=0)
+    e2e.add_argument(
+        "--client", choices=("requests", "asyncio"), default="requests" if main.requests_available() else "asyncio",
+        help="发送请求所用的 HTTP 客户端，未安装 requests 时默认 asyncio")
+    args = parser.parse_args()
+
+    if args.command == "parsers":
+        report = bench_parsers(args.fixtures)
+    else:
+        report = bench_e2e(args.fixtures, args.runs, args.latency, args.error_rate, args.seed, args.client)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key}: {value}")
@@ -0,0 +1,135 @@
+import math
+import signal
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from store import SnapshotStore
+
+# --------------------------
+# 盘中轮询
+# --------------------------
+# 常驻进程：整个生命周期只加载一次配置、复用同一个连接池，
+# 交易时段内按固定间隔抓取 stocks_index 行情，样本放入固定大小的环形缓冲区，定期落盘。
+beijing_tz = timezone(timedelta(hours=8))
+# 北京时间的连续交易时段（A 股）
+trading_sessions = [((9, 30), (11, 30)), ((13, 0), (15, 0))]
+
+def session_bounds(day):
+    for (h1, m1), (h2, m2) in trading_sessions:
+        yield day.replace(hour=h1, minute=m1, second=0, microsecond=0), day.replace(hour=h2, minute=m2, second=0, microsecond=0)
+
+def seconds_until_open(now, is_trading_day=None):
+    """
+    在交易时段内返回 0，否则返回距下一个交易时段开始的秒数。
+    is_trading_day(date) 由调用方按交易日历传入，缺省时只跳过周末。
+    """
+    is_trading_day = is_trading_day or (lambda day: day.weekday() < 5)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    for offset in range(15):
+        day = today + timedelta(days=offset)
+        if not is_trading_day(day.date()):
+            continue
+        for start, end in session_bounds(day):
+            if start <= now < end:
+                return 0.0
+            if now < start:
+                return (start - now).total_seconds()
+    return 3600.0
+
+class SnapshotRing:
+    """
+    固定容量的环形缓冲区：每个样本是一个时间戳加所有指数的数值，缺失为 NaN。
+    数值按 [样本][指数] 连续存放在一个 array('d') 中，不随运行时间增长。
+    """
+
+    def __init__(self, names, capacity):
+        self.names = list(names)
+        self.capacity = capacity
+        self.times = array("d", [0.0] * capacity)
+        self.values = array("d", [math.nan] * (capacity * len(self.names)))
+        self.count = 0      # 累计写入的样本数
+        self.flushed = 0    # 已落盘的样本数
+
+    def push(self, timestamp, values):
+        slot = self.count % self.capacity
+        self.times[slot] = timestamp
+        base = slot * len(self.names)
+        for i, name in enumerate(self.names):
+            value = values.get(name)
+            self.values[base + i] = math.nan if value is None else value
+        self.count += 1
+
+    def sample(self, seq):
+        slot = seq % self.capacity
+        base = slot * len(self.names)
+        row = self.values[base:base + len(self.names)]
+        return self.times[slot], {name: (None if math.isnan(v) else v) for name, v in zip(self.names, row)}
+
+    def history(self, name):
+        """返回某个指数缓冲区内的 [(时间戳, 数值), ...]，按时间顺序"""
+        i = self.names.index(name)
+        start = max(0, self.count - self.capacity)
+        result = []
+        for seq in range(start, self.count):
+            slot = seq % self.capacity
+            value = self.values[slot * len(self.names) + i]
+            result.append((self.times[slot], None if math.isnan(value) else value))
+        return result
+
+    def pending(self):
+        """未落盘的样本；落盘间隔内若超过容量，最早的样本已被覆盖"""
+        start = max(self.flushed, self.count - self.capacity)
+        return [self.sample(seq) for seq in range(start, self.count)]
+
+def flush(ring, store, metric):
+    samples = ring.pending()
+    for timestamp, values in samples:
+        moment = datetime.fromtimestamp(timestamp, beijing_tz)
+        store.append(
+            moment.strftime("%Y/%m/%d"),
+            {(name, metric): value for name, value in values.items()},
+            time=moment.isoformat(timespec="seconds"),
+        )
+    ring.flushed = ring.count
+    return len(samples)
+
+def run_daemon(fetch, names, store_path, metric, poll_interval=60.0, ring_size=1440, flush_interval=300.0, is_trading_day=None):
+    """
+    fetch() 返回 {名称: float 或 None}，由调用方传入，复用其会话与配置；
+    is_trading_day 见 seconds_until_open。
+    收到 SIGTERM / SIGINT 时落盘后退出。
+    """
+    ring = SnapshotRing(names, ring_size)
+    store = SnapshotStore(store_path)
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    def sleep(seconds):
+        # 分段睡眠，收到信号后最多 1 秒内退出
+        deadline = time.monotonic() + seconds
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(max(0.0, min(1.0, deadline - time.monotonic())))
+
+    last_flush = time.monotonic()
+    print(f"盘中轮询已启动：间隔 {poll_interval}s，缓冲 {ring_size} 个样本，每 {flush_interval}s 落盘")
+    while not stopping:
+        wait = seconds_until_open(datetime.now(beijing_tz), is_trading_day)
+        if wait > 0:
+            if ring.count > ring.flushed:
+                flush(ring, store, metric)
+            sleep(min(wait, flush_interval))
+            continue
+        tick = time.monotonic()
+        ring.push(time.time(), fetch())
+        if time.monotonic() - last_flush >= flush_interval:
+            written = flush(ring, store, metric)
+            last_flush = time.monotonic()
+            print(f"{datetime.now(beijing_tz):%H:%M:%S} 落盘 {written} 个样本")
+        sleep(max(0.0, poll_interval - (time.monotonic() - tick)))
+    written = flush(ring, store, metric)
+    print(f"盘中轮询已停止，落盘 {written} 个样本")
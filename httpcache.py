@@ -0,0 +1,79 @@
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+# --------------------------
+# 本地响应缓存
+# --------------------------
+# 以 (数据源, 代码, 交易日) 为键缓存解析后的结果，各数据源声明自己的 cache_ttl（秒）。
+# 总大小超过 max_bytes 时按写入时间淘汰最旧的条目。
+beijing_tz = timezone(timedelta(hours=8))
+
+def trading_date(now=None):
+    return (now or datetime.now(beijing_tz)).astimezone(beijing_tz).strftime("%Y-%m-%d")
+
+class ResponseCache:
+    def __init__(self, path, max_bytes=8 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " provider TEXT, symbol TEXT, date TEXT, stored_at REAL, size INTEGER, value TEXT,"
+            " PRIMARY KEY (provider, symbol, date))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)")
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, provider, symbols, ttl, date=None):
+        """返回 {代码: 结果}，只包含未过期的条目"""
+        if ttl <= 0 or not symbols:
+            return {}
+        date = date or trading_date()
+        found = {}
+        oldest = time.time() - ttl
+        for i in range(0, len(symbols), 500):
+            chunk = symbols[i:i + 500]
+            rows = self.db.execute(
+                f"SELECT symbol, value FROM responses WHERE provider = ? AND date = ? AND stored_at >= ?"
+                f" AND symbol IN ({','.join('?' * len(chunk))})",
+                [provider, date, oldest, *chunk],
+            )
+            for symbol, value in rows:
+                value = json.loads(value)
+                found[symbol] = tuple(value) if isinstance(value, list) else value
+        self.hits += len(found)
+        self.misses += len(symbols) - len(found)
+        return found
+
+    def put_many(self, provider, values, date=None):
+        date = date or trading_date()
+        now = time.time()
+        rows = []
+        for symbol, value in values.items():
+            text = json.dumps(value, ensure_ascii=False)
+            rows.append((provider, symbol, date, now, len(text), text))
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.evict()
+
+    def evict(self):
+        (total,) = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        removed = 0
+        doomed = []
+        for rowid, size in self.db.execute("SELECT rowid, size FROM responses ORDER BY stored_at"):
+            doomed.append((rowid,))
+            removed += size
+            if removed >= excess:
+                break
+        self.db.executemany("DELETE FROM responses WHERE rowid = ?", doomed)
+
+    def close(self):
+        self.db.close()
@@ -1,911 +1,913 @@
+import argparse
+import importlib.util
 import os
-import requests
+import sys
 import time
-import openpyxl
-import json
-import hashlib
-import re
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from metrics import run_metrics
+from providers import Quote, get_provider
+from registry import load_registry, load_universe
+from store import SnapshotStore
+
+# requests、asynchttp、openpyxl（xlsx_writer）与响应缓存在用到时才导入：
+# 各子命令只加载自己需要的依赖，例如 report 不导入任何第三方库，fetch 不导入 openpyxl
 
 # --------------------------
-# Excel 工具函数
+# 股票与指数配置
 # --------------------------
-def detect_last_col(ws):
-    last_col = 1
-    for col in range(1, ws.max_column + 1):
-        column_values = [ws.cell(row=row, column=col).value for row in range(1, ws.max_row + 1)]
-        if any(v is not None and v != "" for v in column_values):
-            last_col = col
-    return last_col
-
-def set_column_style(ws, col_idx):
-    for row in ws.iter_rows(min_col=col_idx, max_col=col_idx, min_row=1, max_row=ws.max_row):
-        for cell in row:
-            cell.font = openpyxl.styles.Font(name="宋体", size=12)
-            cell.alignment = openpyxl.styles.Alignment(horizontal="center", vertical="center")
-    ws.cell(row=2, column=col_idx).font = openpyxl.styles.Font(name="宋体", size=12, bold=True)
-    for i in range(1, col_idx + 1):
-      ws.column_dimensions[openpyxl.utils.get_column_letter(i)].width = 15
-
-def safe_float_convert(val):
-    try:
-        return round(float(val), 2)
-    except Exception:
-        return val
+# 指数列表、行号与估值权重保存在 instruments.json，加载为只读登记表
+base_dir = os.path.dirname(os.path.abspath(__file__))
+config_path = os.path.join(base_dir, "instruments.json")
+stocks_index, pe_pb_xilv = load_registry(config_path)
 
-def write_number_cell(ws, row, col, value):
-    if isinstance(value, (int, float)):
-        rounded = round(float(value), 2)
-        ws.cell(row=row, column=col, value=rounded)
-        ws.cell(row=row, column=col).number_format = '0.00'
-    else:
-        ws.cell(row=row, column=col, value=value)
+# 成分股列表（如沪深300、中证500全部成分）：universes/<名称>.txt，每行一个代码；
+# 抓取结果写入同目录下的 <名称>.snap，每个列表一个分区，不写入工作簿
+universe_dir = os.path.join(base_dir, "universes")
+universe_provider = "gtimg"
 
 # --------------------------
-# 股票与指数配置
+# 请求设置
 # --------------------------
-stock_index_start_row = 7
-stock_val_start_row = 6
-
-# 定义字典
-stocks_index = {
-  "上证点数": {
-    "code": "000001",
-    "row": 4,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sh",
-  },
-  "中证A500": {
-    "code": "000510",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sh",
-  },
-  "沪深300": {
-    "code": "000300",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sh",
-  },
-  "中证500": {
-    "code": "000905",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sh",
-  },
-  "沪港深500": {
-    "code": "CSIH30455",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "标普500": {
-    "code": "usINX",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_",
-  },
-  "印度": {
-    "code": "SENSEX",
-    "row": 0,
-    "result": "",
-    "url": "https://w.sinajs.cn/list=znb_",
-  },
-  "德国": {
-    "code": "DAX_i",
-    "row": 0,
-    "result": "",
-    "url": "https://w.sinajs.cn/list=znb_",
-  },
-  "日本": {
-    "code": "NKY_i",
-    "row": 0,
-    "result": "",
-    "url": "https://w.sinajs.cn/list=znb_",
-  },
-  "中证红利": {
-    "code": "000922",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sh",
-  },
-  "红利质量": {
-    "code": "CSI931468",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "创业板50": {
-    "code": "399673",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sz",
-  },
-  "创业板指": {
-    "code": "399006",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sz",
-  },
-  "中证医疗": {
-    "code": "399989",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sz",
-  },
-  "300医药": {
-    "code": "000913",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sh",
-  },
-  "消费龙头": {
-    "code": "CSI931068",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "家用电器": {
-    "code": "CSI930697",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "中证白酒": {
-    "code": "399997",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sz",
-  },
-  "中证消费": {
-    "code": "000932",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sh",
-  },
-  "恒生医药": {
-    "code": "HKHSHKBIO",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "中概互联": {
-    "code": "CSIH30533",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "中证中药": {
-    "code": "CSI930641",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "恒生互联网": {
-    "code": "HKHSIII",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "恒生科技": {
-    "code": "HKHSTECH",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "全指医药": {
-    "code": "000991",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sh",
-  },
-  "保险": {
-    "code": "399809",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sz",
-  },
-  "中证新能源": {
-    "code": "399808",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sz",
-  },
-  "中证光伏": {
-    "code": "CSI931151",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "新能源车": {
-    "code": "399417",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sz",
-  },
-  "CS创新药": {
-    "code": "CSI931152",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "医疗器械": {
-    "code": "BK0044",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "半导体": {
-    "code": "CSIH30184",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "中证军工": {
-    "code": "399967",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sz",
-  },
-  "中证畜牧": {
-    "code": "CSI930707",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "证券行业": {
-    "code": "399975",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sz",
-  },
-  "中证有色": {
-    "code": "CSI930708",
-    "row": 0,
-    "result": "",
-    "url": "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol=",
-  },
-  "基建工程": {
-    "code": "399995",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sz",
-  },
-  "国证地产": {
-    "code": "399393",
-    "row": 0,
-    "result": "",
-    "url": "https://qt.gtimg.cn/?q=s_sz",
-  }
-}
-pe_pb_xilv={
-"沪深全A(万德全A)":{
-    "row":3,
-    "code":"881001.WI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"中证A500":{
-    "row": 0,
-    "code":"000510.SH",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"沪深300":{
-    "row": 0,
-    "code":"000300.SH",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"中证500":{
-    "row": 0,
-    "code":"000905.SH",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"沪港深500":{
-    "row": 0,
-    "code":"H30455.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"标普500":{
-    "row": 0,
-    "code":"SPX.GI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"印度(印度孟买SENSEX30)":{
-    "row": 0,
-    "code":"SENSEX.BO",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"德国(德国DAX)":{
-    "row": 0,
-    "code":"GDAXI.GI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"日本(日经225)":{
-    "row": 0,
-    "code":"N225.GI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"中证红利":{
-    "row": 0,
-    "code":"000922.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.3,0.3,0.4]
-},
-"红利质量":{
-    "row": 0,
-    "code":"931468.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"创业板50":{
-    "row": 0,
-    "code":"399673.SZ",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"创业板指":{
-    "row": 0,
-    "code":"399006.SZ",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"中证医疗":{
-    "row": 0,
-    "code":"399989.SZ",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"300医药":{
-    "row": 0,
-    "code":"000913.SH",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"消费龙头":{
-    "row": 0,
-    "code":"931068.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"家用电器":{
-    "row": 0,
-    "code":"930697.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"中证白酒":{
-    "row": 0,
-    "code":"399997.SZ",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"中证消费":{
-    "row": 0,
-    "code":"000932.SH",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"恒生医药(恒生医疗保健)":{
-    "row": 0,
-    "code":"HSHCI.HI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"中概互联(中国互联网50)":{
-    "row": 0,
-    "code":"H30533.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"中证中药":{
-    "row": 0,
-    "code":"930641.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"恒生互联网(恒生互联网科技业)":{
-    "row": 0,
-    "code":"HSIII.HI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"恒生科技(恒生科技指数)":{
-    "row": 0,
-    "code":"HSTECH.HI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"全指医药":{
-    "row": 0,
-    "code":"000991.SH",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"保险(保险II(申万))": {
-  "row": 0,
-  "code":"801194.SI",
-  "pe_new_value":0,
-  "pe_new_percent_value":0,
-  "pb_new_value":0,
-  "pb_new_percent_value":0,
-  "xilv_new_value":0,
-  "xilv_new_percent_value":0,
-  "calc":[0.5,0.5,0],
-  "rewrite_row":79
-},
-"中证新能源(中证新能)":{
-    "row": 0,
-    "code":"399808.SZ",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"中证光伏(光伏产业)":{
-    "row": 0,
-    "code":"931151.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"新能源车":{
-    "row": 0,
-    "code":"930997.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"CS创新药":{
-    "row": 0,
-    "code":"931152.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"医疗器械":{
-    "row": 0,
-    "code":"h30217.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"半导体(中证全指半导体)":{
-    "row": 0,
-    "code":"h30184.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.5,0.5,0]
-},
-"中证军工":{
-    "row": 0,
-    "code":"399967.SZ",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.3,0.7,0]
-},
-"中证畜牧":{
-    "row": 0,
-    "code":"930707.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.3,0.7,0]
-},
-"证券行业(证券公司)":{
-    "row": 0,
-    "code":"399975.SZ",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.3,0.7,0]
-},
-"中证有色":{
-    "row": 0,
-    "code":"930708.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.3,0.7,0]
-},
-"基建工程(中证基建工程)":{
-    "row": 0,
-    "code":"399995.SZ",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.3,0.7,0]
-},
-"国证地产(中证全指房地产)":{
-    "row": 0,
-    "code":"931775.CSI",
-    "pe_new_value":0,
-    "pe_new_percent_value":0,
-    "pb_new_value":0,
-    "pb_new_percent_value":0,
-    "xilv_new_value":0,
-    "xilv_new_percent_value":0,
-    "calc":[0.3,0.7,0]
-}
-}
-
-# 自动补充行号
-row_value = stock_index_start_row
-for v in stocks_index.values():
-    if v["row"] == 0:
-        v["row"] = row_value
-        row_value += 3
-
-row_value = stock_val_start_row
-for v in pe_pb_xilv.values():
-    if v["row"] == 0:
-        v["row"] = row_value
-        row_value += 3
-    v["rewrite_row"] = v.get("rewrite_row", 0)
+session = None
+http_client = None
+
+def requests_available():
+    return importlib.util.find_spec("requests") is not None
+
+def get_http_client():
+    """基于 asyncio 的标准库 HTTP 客户端，按主机保持长连接"""
+    global http_client
+    if http_client is None:
+        from asynchttp import AsyncHTTPClient
+        http_client = AsyncHTTPClient(max_per_host=8)
+    return http_client
+
+def get_session():
+    global session
+    if session is None:
+        import requests
+        session = requests.Session()
+        # 连接池需容纳并发抓取时的全部线程
+        session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=16))
+    return session
+
+# 估值数据所用的数据源，以及回填历史百分位所用的图表数据源
+valuation_provider = "jiucaishuo"
+history_provider = "jiucaishuo_history"
+
+# 临时性错误（连接失败、超时、429/5xx）的重试次数与退避参数（秒）
+retry_attempts = 3
+retry_base_delay = 0.5
+retry_max_delay = 8.0
+
+# 所有数据源共享的全局限流：同时进行的请求数与相邻请求的最小发起间隔（秒）
+global_concurrency = 8
+global_interval = 0.05
 
 # --------------------------
-# 请求设置
+# 并发抓取引擎
+# --------------------------
+class Throttle:
+    """限制同一数据源的并发数，并保证相邻两次请求的发起间隔不小于 interval"""
+
+    def __init__(self, concurrency, interval):
+        self.semaphore = threading.Semaphore(concurrency)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+        return False
+
+# 各数据源自身的限流之外，进程内全部请求还要经过这一个全局限流
+global_throttle = Throttle(global_concurrency, global_interval)
+
+def is_transient_error(e):
+    # asynchttp 抛出内置的 ConnectionError / TimeoutError；requests 只在已被导入时才需要判断
+    requests = sys.modules.get("requests")
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return True
+    if requests and isinstance(e, (requests.ConnectionError, requests.Timeout)):
+        return True
+    http_errors = tuple(m.HTTPError for m in (sys.modules.get("asynchttp"), requests) if m)
+    if isinstance(e, http_errors) and e.response is not None:
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return False
+
+def backoff_delay(attempt):
+    # 指数退避 + 全抖动，避免多个线程同时重试
+    return random.uniform(0, min(retry_max_delay, retry_base_delay * 2 ** attempt))
+
+# 两种客户端都只声明能解码的压缩方式，避免服务端按浏览器请求头返回 br / zstd
+accept_encoding = "gzip, deflate"
+
+def session_transport(provider, batch, method, url, headers, body):
+    headers = {**headers, "Accept-Encoding": accept_encoding}
+    return get_session().request(method, url, headers=headers, data=body, timeout=10)
+
+def fast_transport(provider, batch, method, url, headers, body):
+    headers = {**headers, "Accept-Encoding": accept_encoding}
+    return get_http_client().request(method, url, headers=headers, data=body, timeout=10, default_encoding=provider.encoding)
+
+def default_transport(provider, batch, method, url, headers, body):
+    """声明 fast_path 的行情数据源走 asynchttp；未安装 requests 时全部数据源都走 asynchttp"""
+    if provider.fast_path or not requests_available():
+        return fast_transport(provider, batch, method, url, headers, body)
+    return session_transport(provider, batch, method, url, headers, body)
+
+# 实际发送请求的函数，录制 / 回放（replay.py）时替换
+transport = default_transport
+
+def fetch_batch(provider, batch):
+    method, url, request_headers, body = provider.build_request(batch)
+    start = time.perf_counter()
+    try:
+        response = transport(provider, batch, method, url, request_headers, body)
+    except Exception:
+        run_metrics.record_request(provider.name, time.perf_counter() - start, 0, ok=False)
+        raise
+    run_metrics.record_request(provider.name, time.perf_counter() - start, len(response.content), ok=response.ok)
+    response.raise_for_status()
+    return provider.parse(response.content, batch)
+
+def is_cacheable(value):
+    if isinstance(value, tuple):
+        return any(v is not None for v in value)
+    return value is not None and value != ""
+
+def fetch_symbols(wanted, cache=None, latency=None):
+    """
+    wanted: {数据源名: [代码, ...]}
+    按各数据源声明的批大小分组并发请求，每个数据源单独限流并共享全局限流，临时性错误按指数退避重试。
+    传入 cache 时先取未过期的缓存，只请求缺失的代码，成功结果写回缓存。
+    传入 latency 字典时填入 {(数据源名, 代码): 所在批次的耗时秒数（含重试）}，取自缓存的代码不填。
+    返回 {(数据源名, 代码): (ok, 结果或异常)}，整体耗时取决于最慢的数据源而不是所有请求之和。
+    """
+    results = {}
+    jobs = []
+    for name, symbols in wanted.items():
+        provider = get_provider(name)
+        symbols = list(dict.fromkeys(symbols))
+        cached = cache.get_many(provider.name, symbols, provider.cache_ttl) if cache else {}
+        if cache:
+            run_metrics.record_cache(provider.name, len(cached), len(symbols) - len(cached))
+        for symbol, value in cached.items():
+            results[(provider.name, symbol)] = (True, value)
+        missing = [symbol for symbol in symbols if symbol not in cached]
+        provider.prepare(missing)
+        for batch in provider.batches(missing):
+            jobs.append((provider, batch))
+    throttles = {p.name: Throttle(p.concurrency, p.interval) for p, _ in jobs}
+    workers = min(global_concurrency, sum(get_provider(name).concurrency for name in throttles)) or 1
+
+    def run(provider, batch):
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            with throttles[provider.name], global_throttle:
+                try:
+                    return True, fetch_batch(provider, batch), time.perf_counter() - start
+                except Exception as e:
+                    error = e
+            if attempt >= retry_attempts or not is_transient_error(error):
+                return False, error, time.perf_counter() - start
+            run_metrics.record_retry(provider.name)
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    fresh = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [(provider, batch, pool.submit(run, provider, batch)) for provider, batch in jobs]
+        for provider, batch, future in futures:
+            ok, value, elapsed = future.result()
+            for symbol in batch:
+                if latency is not None:
+                    latency[(provider.name, symbol)] = elapsed
+                if not ok:
+                    results[(provider.name, symbol)] = (False, value)
+                elif symbol in value:
+                    results[(provider.name, symbol)] = (True, value[symbol])
+                    if provider.cache_ttl > 0 and is_cacheable(value[symbol]):
+                        fresh.setdefault(provider.name, {})[symbol] = value[symbol]
+                else:
+                    results[(provider.name, symbol)] = (False, LookupError("响应中没有该代码"))
+    if cache:
+        for name, values in fresh.items():
+            cache.put_many(name, values)
+    return results
+
 # --------------------------
-session = requests.Session()
-headers = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:145.0) Gecko/20100101 Firefox/145.0",
-    "Accept": "*/*",
-    "Accept-Language": "zh-CN",
-    "Accept-Encoding": "gzip, deflate, br, zstd",
-    "Sec-Fetch-Storage-Access": "none",
-    "DNT": "1",
-    "Sec-GPC": "1",
-    "Connection": "keep-alive",
-    "Referer": "https://finance.sina.com.cn/",
-    "Sec-Fetch-Dest": "script",
-    "Sec-Fetch-Mode": "no-cors",
-    "Sec-Fetch-Site": "cross-site",
-}
+# 抓取状态
+# --------------------------
+# 每个指数本次抓取的状态随快照一起保存在快照存储中，键为 (名称, 主指标)：
+# ok 为本次请求成功，stale 为取自响应缓存，failed 为请求失败或没有数值；refetch --failed 只重新抓取 failed 的指数
+status_ok = "ok"
+status_stale = "stale"
+status_failed = "failed"
+
+def fetch_status(value, error, seconds):
+    """返回 (状态, 错误信息, 耗时毫秒)；seconds 为 None 表示取自缓存"""
+    latency = None if seconds is None else round(seconds * 1000, 1)
+    if value is None:
+        return status_failed, error, latency
+    return (status_ok if seconds is not None else status_stale), "", latency
+
+def describe_error(e):
+    return f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+
+def status_label(name, metric):
+    # 同名的行情指数与估值指数用指标区分
+    return name if metric == metric_price else f"{name} 估值"
 
 # --------------------------
 # 抓取指数数据
 # --------------------------
-def fetch_stock_data_to_ws(ws, target_col):
-    for name, data in stocks_index.items():
-        url = data["url"] + data["code"]
-        try:
-            response = session.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-
-            # 解析数据
-            if "qt.gtimg.cn" in url:
-                # qt.gtimg.cn 的响应以 ~ 分隔，价格一般在第 4 个位置（索引 3）
-                parts = response.text.split("~")
-                if len(parts) > 3 and parts[3] != '':
-                    parsed = parts[3]
-                else:
-                    parsed = parts[0]
-                data["result"] = parsed
-            elif "xueqiu.com" in url:
-                # 解析 xueqiu.com 的 JSON 响应
-                json_data = response.json()
-                data["result"] = json_data["data"][0]["current"]  # 提取 current 值
-            elif "sinajs.cn" in url:
-                # 解析 sina 的响应；保守匹配浮点数
-                match = re.search(r'([0-9]+\.[0-9]+)', response.text)
-                if match:
-                    data["result"] = match.group(1)
-
-            print(f"{name}: {data.get('result')}")
-            if data["row"] == 4:
-                # 写入日期和标题
-                ws.cell(row=1, column=target_col, value=datetime.now().strftime("%Y/%m/%d"))
-                ws.cell(row=2, column=target_col, value="上证")
-            # 尝试写入浮点并限制两位小数
-            val = data.get("result", "")
-            numeric_val = safe_float_convert(val)
-            write_number_cell(ws, data["row"], target_col, numeric_val)
-        except Exception as e:
-            print(f"请求 {name} 数据失败: {e}")
-        # 轻微等待，避免请求过快
-        time.sleep(1)
+def entry_symbol(inst, provider_name=None):
+    """返回 (数据源名, 接口代码)"""
+    provider = get_provider(provider_name or inst.provider)
+    return provider.name, provider.symbol(inst.code)
+
+def to_float(val):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+def quote_values(name, quote):
+    """Quote（缓存中读出的是普通 tuple）展开为 {(名称, 指标): float 或 None}"""
+    quote = Quote(*quote) if quote is not None else Quote(None, None, None, None)
+    return {(name, metric): to_float(getattr(quote, metric)) for metric in quote_metrics}
+
+def fetch_stock_data(cache=None, quiet=False, instruments=None, status=None):
+    """
+    抓取 stocks_index（或其中的 instruments）行情，返回 {(名称, "price"/"change"/"pct_change"/"volume"): float 或 None}。
+    传入 status 字典时填入每个指数的抓取状态，键为 (名称, "price")。
+    """
+    instruments = stocks_index if instruments is None else instruments
+    wanted = {}
+    for inst in instruments:
+        provider_name, symbol = entry_symbol(inst)
+        wanted.setdefault(provider_name, []).append(symbol)
+    latency = {}
+    results = fetch_symbols(wanted, cache, latency)
+
+    values = {}
+    for inst in instruments:
+        key = entry_symbol(inst)
+        ok, value = results[key]
+        if not ok:
+            print(f"请求 {inst.name} 数据失败: {value}")
+            values.update(quote_values(inst.name, None))
+            if status is not None:
+                status[(inst.name, metric_price)] = fetch_status(None, describe_error(value), latency.get(key))
+            continue
+        values.update(quote_values(inst.name, value))
+        if status is not None:
+            status[(inst.name, metric_price)] = fetch_status(values[(inst.name, metric_price)], "响应中没有点位", latency.get(key))
+        if not quiet:
+            print(f"{inst.name}: {values[(inst.name, metric_price)]}")
+    return values
 
 # --------------------------
 # 获取 PE / PB / Xilv 数据
 # --------------------------
-def split_md5(md5_string, ts, gu_code):
-    return {
-        "gu_code": gu_code,
-        "pe_category": "pe",
-        "year": -1,
-        "category": "",
-        "ver": "new",
-        "type": "pc",
-        "version": "2.2.7",
-        "authtoken": "",
-        "act_time": ts,
-        'yi854tew': md5_string[29:31],
-        'u54rg5d': md5_string[2:4],
-        'bioduytlw': md5_string[5:6],
-        'nkjhrew': md5_string[26:27],
-        'bvytikwqjk': md5_string[6:8],
-        'tiklsktr4': md5_string[1:2],
-        'tirgkjfs': md5_string[0:2],
-        'bgd7h8tyu54': md5_string[6:8],
-        'yt447e13f': md5_string[8:9],
-        'nd354uy4752': md5_string[30:31],
-        'ghtoiutkmlg': md5_string[11:14],
-        'y654b5fs3tr': md5_string[11:12],
-        'fjlkatj': md5_string[2:5],
-        'jnhf8u5231': md5_string[9:11],
-        'sbnoywr': md5_string[23:25],
-        'kf54ge7': md5_string[31:32],
-        'hy5641d321t': md5_string[25:27],
-        'bgiuytkw': md5_string[9:11],
-        'quikgdky': md5_string[27:29],
-        'ngd4uy551': md5_string[17:19],
-        'bd4uy742': md5_string[26:27],
-        'ngd4yut78': md5_string[12:14],
-        'iogojti': md5_string[25:26],
-        'h67456y': md5_string[16:19],
-        'lksytkjh': md5_string[17:21],
-        'n3bf4uj7y7': md5_string[18:19],
-        'nbf4uj7y432': md5_string[21:23],
-        'ibvytiqjek': md5_string[14:16],
-        'h13ey474': md5_string[29:32],
-        'abiokytke': md5_string[21:23],
-        'bd24y6421f': md5_string[24:26],
-        'tbvdiuytk': md5_string[16:17],
-    }
-
-def fetch_pe_pb_xilv_data(gu_code, ts):
+def calc_valuation_score(values, calc):
+    """按 calc 权重加权并保留两位小数；权重非 0 的分量缺失时返回 None"""
+    total = 0.0
+    for value, weight in zip(values, calc):
+        if not weight:
+            continue
+        if value is None:
+            return None
+        total += value * weight
+    return round(total, 2)
+
+def fetch_pe_pb_xilv_data(cache=None, instruments=None, status=None):
     """
-    发起估值接口请求，返回 pe, pb, xilv 三个数值（float）。
-    出错时返回 0,0,0。
+    抓取 pe_pb_xilv（或其中的 instruments）估值，返回 {(名称, "score"/"point"/"pe"/"pb"/"xilv"): float 或 None}。
+    传入 status 字典时填入每个指数的抓取状态，键为 (名称, "score")。
     """
-    try:
-        t = f"{ts}{gu_code}pepcnew2.2.7-1EWf45rlv#kfsr@k#gfksgkr"
-        md5_value = hashlib.md5(t.encode('utf-8')).hexdigest()
-        md5_parts = split_md5(md5_value, ts, gu_code)
-        body = json.dumps(md5_parts)
-        headers2 = {
-            "Host": "api.jiucaishuo.com",
-            "Content-Type": "application/json;charset=UTF-8",
-            "User-Agent": headers["User-Agent"],
-        }
-        r = requests.post("https://api.jiucaishuo.com/v2/guzhi/newtubiaodata", headers=headers2, data=body, timeout=10)
-        if r.status_code == 200:
-            data = r.json()
-            # 取 new_percent_value 中的百分比数字并转 float
-            point_str = data.get('data', {}).get('top_data', [None, {}, {}, {}])[0].get('new_value', {}).get('value', '0')
-            pe_str = data.get('data', {}).get('top_data', [None, {}, {}, {}])[1].get('new_percent_value', {}).get('value', '0')
-            pb_str = data.get('data', {}).get('top_data', [None, {}, {}, {}])[2].get('new_percent_value', {}).get('value', '0')
-            xilv_str = data.get('data', {}).get('top_data', [None, {}, {}, {}])[3].get('new_percent_value', {}).get('value', '0')
-
-            def parse_percent(s):
-                try:
-                    return float(str(s).replace('%', '').strip() or 0.0)
-                except:
-                    return 0.0
-            point = parse_percent(point_str)
-            pe = parse_percent(pe_str)
-            pb = parse_percent(pb_str)
-            xilv = parse_percent(xilv_str)
-            # 保留两位小数
-            point = round(point, 2)
-            pe = round(pe, 2)
-            pb = round(pb, 2)
-            xilv = round(xilv, 2)
-            return point, pe, pb, xilv
-    except Exception as e:
-        print(f"估值接口出错: {e}")
-    return 0.0, 0.0, 0.0, 0.0
-
-def update_pe_pb_xilv_to_ws(ws, target_col):
-    for name, data in pe_pb_xilv.items():
-        if data["row"] == 0:
+    instruments = pe_pb_xilv if instruments is None else instruments
+    wanted = {valuation_provider: [entry_symbol(inst, valuation_provider)[1] for inst in instruments]}
+    latency = {}
+    results = fetch_symbols(wanted, cache, latency)
+
+    values = {}
+    for inst in instruments:
+        name = inst.name
+        key = entry_symbol(inst, valuation_provider)
+        ok, value = results[key]
+        if not ok:
+            # 请求失败：记为缺失，而不是写入 0
+            print(f"{name} 估值接口出错: {value}")
+            for metric in valuation_metrics:
+                values[(name, metric)] = None
+            if status is not None:
+                status[(name, metric_score)] = fetch_status(None, describe_error(value), latency.get(key))
             continue
-        point, pe, pb, xilv = fetch_pe_pb_xilv_data(data["code"], int(time.time() * 1000))
+        point, pe, pb, xilv = value
         # 结果按 calc 权重计算，并保留两位小数
+        result = calc_valuation_score((pe, pb, xilv), inst.calc)
+        if status is not None:
+            status[(name, metric_score)] = fetch_status(result, "估值分量缺失", latency.get(key))
+        values[(name, metric_score)] = result
+        values[(name, metric_point)] = point
+        # 同时保存原始百分位，权重调整后可用 rescore 子命令重新计算历史结果
+        values.update(zip(((name, metric) for metric in component_metrics), (pe, pb, xilv)))
+        print(f"{name} 估值结果: \n\t代码: {inst.code}\n\tpe百分位: {pe} pb百分位: {pb} 息率: {xilv}\n\t权重: {list(inst.calc)}\n\t结果: {'缺失' if result is None else result}")
+    return values
+
+# --------------------------
+# 快照与工作簿布局
+# --------------------------
+metric_price = "price"   # 指数点位（stocks_index）
+metric_score = "score"   # 按 calc 加权后的估值百分位（pe_pb_xilv）
+metric_point = "point"   # 估值接口给出的点位，仅写入 rewrite_row
+component_metrics = ("pe", "pb", "xilv")   # 原始估值百分位，只保存在快照存储中
+quote_metrics = ("price", "change", "pct_change", "volume")   # 行情字段，除 price 外只保存在快照存储中
+valuation_metrics = (metric_score, metric_point, *component_metrics)   # 一次估值抓取写入的全部指标
+
+def snapshot_layout():
+    """按写入顺序返回 [(行号, (名称, 指标)), ...]；同一行后写入的覆盖先写入的"""
+    layout = [(inst.row, (inst.name, metric_price)) for inst in stocks_index]
+    layout.extend((inst.row, (inst.name, metric_score)) for inst in pe_pb_xilv)
+    layout.extend((inst.rewrite_row, (inst.name, metric_point)) for inst in pe_pb_xilv if inst.rewrite_row)
+    return layout
+
+def import_xlsx_history(store, xlsx_path):
+    """
+    首次启用快照存储时，把现有工作簿中的每一列导入为一个快照。
+    旧版本在估值接口出错时写入 0 作为估值结果与点位，导入时按缺失处理，避免混入真实数据。
+    """
+    from xlsx_writer import read_xlsx_columns
+    for date, values in read_xlsx_columns(xlsx_path, snapshot_layout()):
+        for key, value in values.items():
+            if key[1] in (metric_score, metric_point) and value == 0:
+                values[key] = None
+        store.append(date, values)
+
+def append_snapshot_to_xlsx(xlsx_path, date, values, exported=None):
+    """
+    优先就地修补 xlsx 中的工作表 XML，耗时只与新增一列有关；
+    工作簿不存在或结构不支持（例如缺少命名样式）时退回 openpyxl 完整读写。
+    exported 为追加后工作簿中已导出的快照数，记在工作簿的定义名称中。
+    """
+    import xlsx_writer
+    if os.path.exists(xlsx_path):
+        from xlsx_patch import PatchUnsupported, append_column_in_place
+        styles = (xlsx_writer.cell_style_name, xlsx_writer.number_style_name, xlsx_writer.header_style_name)
         try:
-            result = pe * data["calc"][0] + pb * data["calc"][1] + xilv * data["calc"][2]
-            result = round(float(result), 2)
-        except Exception:
-            result = 0.0
-        write_number_cell(ws, data["row"], target_col, result)
-        if data["rewrite_row"]:
-            write_number_cell(ws, data["rewrite_row"], target_col, point)
-        print(f"{name} 估值结果: \n\t代码: {data['code']}\n\tpe百分位: {pe} pb百分位: {pb} 息率: {xilv}\n\t权重: {data['calc']}\n\t结果: {result}")
-        time.sleep(1)
+            with run_metrics.stage("patch_xlsx"):
+                append_column_in_place(
+                    xlsx_path, date, values, snapshot_layout(), "上证", styles,
+                    xlsx_writer.column_width, xlsx_writer.last_col_name,
+                    counters=None if exported is None else {xlsx_writer.exported_name: exported})
+            return
+        except PatchUnsupported as e:
+            print(f"无法就地追加（{e}），改用 openpyxl 完整读写")
+    xlsx_writer.append_column(xlsx_path, date, values, snapshot_layout(), exported=exported)
+
+def rebuild_xlsx(store, xlsx_path):
+    """由快照矩阵流式重新生成整个工作簿"""
+    from xlsx_writer import exported_name, last_col_name, write_xlsx_streaming
+    with open_matrix(store).open() as view:
+        write_xlsx_streaming(
+            xlsx_path, view, snapshot_layout(), last_col_name=last_col_name, exported_name=exported_name)
 
 # --------------------------
 # 导出实时数据
 # --------------------------
-def export_realtime_data():
-    xlsx_path = os.path.join(os.path.dirname(__file__), "stocks_data.xlsx")
+# 工作簿、快照存储及由它派生的文件都位于 data_dir 下，基准测试用 set_data_dir 整体切换到临时目录；
+# 新增输出文件时在这里一并派生，避免临时运行改写仓库中的文件
+def set_data_dir(path):
+    global data_dir, xlsx_path, store_path, matrix_path, history_path, intraday_path, cache_path
+    global analytics_path, analytics_state_path
+    data_dir = path
+    xlsx_path = os.path.join(data_dir, "stocks_data.xlsx")
+    store_path = os.path.join(data_dir, "stocks_data.snap")
+    matrix_path = os.path.join(data_dir, "stocks_data.matrix")
+    history_path = os.path.join(data_dir, "stocks_history.snap")
+    intraday_path = os.path.join(data_dir, "stocks_intraday.snap")
+    cache_path = os.path.join(data_dir, ".cache", "responses.sqlite3")
+    analytics_path = os.path.join(data_dir, "stocks_analytics.xlsx")
+    analytics_state_path = os.path.join(data_dir, "stocks_analytics.state.json")
+
+set_data_dir(base_dir)
+calendar_path = os.path.join(base_dir, "trading_calendar.json")
+
+def open_cache(use_cache=True):
+    if not use_cache:
+        return None
+    from httpcache import ResponseCache
+    return ResponseCache(cache_path)
+
+def open_store():
+    store = SnapshotStore(store_path)
+    if not store.exists() and os.path.exists(xlsx_path):
+        import_xlsx_history(store, xlsx_path)
+    return store
+
+def open_matrix(store=None):
+    """与快照存储同步后的定长快照矩阵，供按指数 / 按日期切片读取历史"""
+    from matrix import SnapshotMatrix
+    return SnapshotMatrix(matrix_path).sync(store or open_store())
+
+def rescore_history():
+    """按当前 calc 权重重新计算快照存储中全部历史的估值结果，并重新生成工作簿"""
+    from scoring import rescore_snapshots
+    store = open_store()
+    calc_by_name = {inst.name: inst.calc for inst in pe_pb_xilv}
+    snapshots, changed = rescore_snapshots(store, calc_by_name, score_metric=metric_score)
+    print(f"重新计算估值结果: {len(snapshots)} 个快照，更新 {changed} 个数值")
+    if changed:
+        # 抓取状态原样保留
+        statuses = [snapshot[3] for _, _, snapshot in store.scan(with_status=True)]
+        store.rewrite((*snapshot, status) for snapshot, status in zip(snapshots, statuses))
+        # 改写后的存储大小可能不变，矩阵需显式重建
+        from matrix import SnapshotMatrix
+        SnapshotMatrix(matrix_path).build(store)
+        rebuild_xlsx(store, xlsx_path)
+    history = SnapshotStore(history_path)
+    backfilled, history_changed = rescore_snapshots(history, calc_by_name, score_metric=metric_score)
+    if history_changed:
+        history.rewrite(backfilled)
+        print(f"重新计算回填历史的估值结果: 更新 {history_changed} 个数值")
+    if changed or history_changed:
+        # 历史估值结果已改变，增量分析状态作废，从头重算
+        if os.path.exists(analytics_state_path):
+            os.remove(analytics_state_path)
+        export_analytics()
+
+def backfilled_scores(before=None):
+    """
+    stocks_history.snap 中回填的每日估值结果：{名称: [(date, score), ...]}，按日期排序，
+    只取早于 before 的日期（与运行快照重叠的日期以运行快照为准）。
+    """
+    history = SnapshotStore(history_path)
+    scores = {}
+    for date, _, values in history:
+        if before is not None and date >= before:
+            continue
+        for inst in pe_pb_xilv:
+            score = values.get((inst.name, metric_score))
+            if score is not None:
+                scores.setdefault(inst.name, []).append((date, score))
+    return scores
+
+def first_snapshot_date():
+    for date, _, _ in SnapshotStore(store_path):
+        return date
+    return None
+
+def backfill_valuation_history():
+    """
+    每个 pe_pb_xilv 代码发一次与日常抓取相同的估值请求，解析响应中的历史图表，按日期写入 stocks_history.snap。
+    图表中没有的分量记为缺失；与已有历史合并，新拉取的数值优先；加权结果按当前 calc 计算。
+    回填的每日估值结果用于 report --history（早于第一个运行快照的部分）与估值 z 分数的初始样本，
+    不写入工作簿：工作簿每列是一次运行。没有解析到任何数据时不改动文件。
+    """
+    provider = get_provider(history_provider)
+    wanted = {provider.name: [provider.symbol(inst.code) for inst in pe_pb_xilv]}
+    results = fetch_symbols(wanted)
+
+    by_date = {}
+    failed = 0
+    for inst in pe_pb_xilv:
+        ok, value = results[(provider.name, provider.symbol(inst.code))]
+        if not ok:
+            failed += 1
+            print(f"{inst.name} 历史数据请求失败: {value}")
+            continue
+        for metric, points in value.items():
+            for date, percentile in points:
+                by_date.setdefault(date, {})[(inst.name, metric)] = percentile
+        print(f"{inst.name}: " + "，".join(f"{metric} {len(points)} 个交易日" for metric, points in value.items()))
+    if not by_date:
+        print(f"没有解析到任何历史数据（{failed} 个请求失败），未改动 {history_path}；"
+              f"可加 --record DIR 录制响应，核对 {history_provider} 的图表字段")
+        return
+
+    history = SnapshotStore(history_path)
+    for date, _, values in history:
+        merged = by_date.setdefault(date, {})
+        for key, value in values.items():
+            merged.setdefault(key, value)
+    for values in by_date.values():
+        for inst in pe_pb_xilv:
+            components = tuple(values.get((inst.name, metric)) for metric in component_metrics)
+            if any(v is not None for v in components):
+                values[(inst.name, metric_score)] = calc_valuation_score(components, inst.calc)
+    history.rewrite((date, "", by_date[date]) for date in sorted(by_date))
+    print(f"历史估值已写入 {history_path}: {len(by_date)} 个交易日，{failed} 个请求失败")
+    # 估值统计的初始样本已改变，增量分析从头重算
+    if os.path.exists(analytics_state_path):
+        os.remove(analytics_state_path)
+    export_analytics()
+
+def universe_path(name, suffix):
+    return os.path.join(universe_dir, name + suffix)
+
+def fetch_universe(universe, cache=None):
+    """抓取一个成分股列表的全部行情，返回 {(代码, 行情指标): float 或 None}"""
+    wanted = {}
+    for inst in universe:
+        provider_name, symbol = entry_symbol(inst)
+        wanted.setdefault(provider_name, []).append(symbol)
+    results = fetch_symbols(wanted, cache)
+
+    values = {}
+    failed = []
+    for inst in universe:
+        ok, value = results[entry_symbol(inst)]
+        values.update(quote_values(inst.name, value if ok else None))
+        if not ok:
+            failed.append(inst.code)
+    if failed:
+        print(f"{len(failed)} 个代码请求失败: {', '.join(failed[:20])}{' ...' if len(failed) > 20 else ''}")
+    return values
+
+def export_universe(name, use_cache=True):
+    """抓取 universes/<name>.txt 中的全部代码，追加为 <name>.snap 中的一个快照"""
+    with run_metrics.stage(f"universe:{name}"):
+        universe = load_universe(universe_path(name, ".txt"), universe_provider)
+        now = datetime.now()
+        cache = open_cache(use_cache)
+        try:
+            values = fetch_universe(universe, cache)
+        finally:
+            if cache:
+                cache.close()
+        SnapshotStore(universe_path(name, ".snap")).append(now.strftime("%Y/%m/%d"), values, time=now.isoformat(timespec="seconds"))
+        fetched = sum(values[(inst.name, metric_price)] is not None for inst in universe)
+        print(f"{name}: {fetched}/{len(universe)} 个代码已写入 {universe_path(name, '.snap')}")
+
+def run_intraday_daemon(poll_interval, ring_size, flush_interval):
+    """盘中常驻轮询 stocks_index 行情，复用本进程的会话与配置，样本写入 stocks_intraday.snap；A 股休市日不轮询"""
+    from daemon import run_daemon
+    calendar = load_trading_calendar()
+
+    def fetch():
+        values = fetch_stock_data(quiet=True)
+        return {inst.name: values[(inst.name, metric_price)] for inst in stocks_index}
+    run_daemon(fetch, stocks_index.names(), intraday_path, metric_price, poll_interval, ring_size, flush_interval,
+               lambda day: calendar.is_trading_day("CN", day))
+
+# --------------------------
+# 运行判断
+# --------------------------
+def load_trading_calendar():
+    from trading_calendar import load_calendar
+    return load_calendar(calendar_path)
+
+def open_markets(calendar=None, now=None):
+    """北京时间 now 对应的交易日仍在交易的市场；日历未覆盖的年份只跳过周末并提示补充"""
+    calendar = calendar or load_trading_calendar()
+    markets = calendar.open_markets(now)
+    for market, year in sorted(calendar.uncovered):
+        print(f"⚠️ {calendar_path} 未包含 {market} {year} 年的休市日，只按周末判断")
+    return markets
+
+def snapshot_unchanged(store, values):
+    """本次抓到的数值与最新快照逐项相同（缺失的不比较）时返回 True，全部缺失也视为无变化"""
+    if not store.exists():
+        return False
+    with open_matrix(store).open() as view:
+        if not len(view):
+            return False
+        _, _, last = view.row(-1)
+    for key, value in values.items():
+        if value is not None and last.get(key) != float(value):
+            return False
+    return True
+
+def fetch_realtime_data(use_cache=True, force=False):
+    """
+    抓取全部行情与估值，追加为快照存储中的一个快照，返回 (date, values)。
+    与最新快照相比没有任何变化时（休市日的行情与估值不更新）不写入，返回 None；force=True 时照常写入。
+    """
+    with run_metrics.stage("open_store"):
+        store = open_store()
+    now = datetime.now()
+    date = now.strftime("%Y/%m/%d")
+
+    cache = open_cache(use_cache)
+    values = {}
+    status = {}
+    try:
+        with run_metrics.stage("fetch_stock_data"):
+            values.update(fetch_stock_data(cache, status=status))
+        with run_metrics.stage("fetch_pe_pb_xilv_data"):
+            values.update(fetch_pe_pb_xilv_data(cache, status=status))
+    finally:
+        if cache:
+            print(f"缓存命中: {cache.hits} 未命中: {cache.misses}")
+            cache.close()
+    failed = [status_label(*key) for key, entry in status.items() if entry[0] == status_failed]
+    if failed:
+        print(f"抓取失败 {len(failed)} 个: {', '.join(failed)}；可运行 refetch --failed 只重新抓取这些指数")
+
+    if not force:
+        with run_metrics.stage("dedupe"):
+            unchanged = snapshot_unchanged(store, values)
+        if unchanged:
+            print("抓取结果与最新快照相同，不写入新快照")
+            return None
+    # 快照存储是数据源头，工作簿只是由它派生的导出
+    with run_metrics.stage("store_append"):
+        store.append(date, values, time=now.isoformat(timespec="seconds"), status=status)
+    with run_metrics.stage("matrix_sync"):
+        open_matrix(store)
+    return date, values
+
+def patch_snapshot_in_xlsx(xlsx_path, date, values):
+    """
+    改写工作簿最后一列中 values 涉及的单元格，优先就地修补工作表 XML，结构不支持时退回 openpyxl。
+    最后一列不是 date 的快照时（例如只运行过 fetch）不改动工作簿，返回 None。
+    """
+    import xlsx_writer
+    from xlsx_patch import PatchUnsupported, patch_column_in_place
+    try:
+        return patch_column_in_place(
+            xlsx_path, date, values, snapshot_layout(), xlsx_writer.number_style_name, xlsx_writer.column_width)
+    except PatchUnsupported as e:
+        print(f"无法就地修补（{e}），改用 openpyxl 完整读写")
+    return xlsx_writer.patch_column(xlsx_path, date, values, snapshot_layout())
+
+def refetch_failed(use_cache=True):
+    """
+    只重新抓取最新快照中状态为 failed 的指数，原位修补快照存储、快照矩阵与工作簿中对应的一列，
+    请求数只与失败项数有关。最新快照不是今天的（例如今天休市未写入）时不做任何事：
+    用今天的行情修补更早的快照会把数据记到错误的日期。
+    没有记录状态的快照（导入的历史、旧版本写入的快照）无从判断失败项，同样跳过；
+    其中的缺失值可能本来就没有对应数据，例如导入时与估值点位共用一行的价格。
+    """
+    with run_metrics.stage("open_store"):
+        store = open_store()
+        matrix = open_matrix(store)
+    last = store.last_with_status()
+    if last is None:
+        print("快照存储为空")
+        return
+    date, time_text, values, status = last
+    # 与 fetch_realtime_data 写入快照时的日期取法一致
+    today = datetime.now().strftime("%Y/%m/%d")
+    if date != today:
+        print(f"最新快照 {date} 不是今天 {today} 的，不重新抓取")
+        return
+    if not status:
+        print(f"最新快照 {date} {time_text} 没有记录抓取状态，无法判断失败项")
+        return
+
+    def failed(name, metric):
+        entry = status.get((name, metric))
+        return entry is not None and entry[0] == status_failed
+    indexes = [inst for inst in stocks_index if failed(inst.name, metric_price)]
+    valuations = [inst for inst in pe_pb_xilv if failed(inst.name, metric_score)]
+    if not indexes and not valuations:
+        print(f"最新快照 {date} {time_text} 没有失败项")
+        return
+    print(f"重新抓取最新快照 {date} {time_text} 的 {len(indexes) + len(valuations)} 个失败项")
+
+    fresh = {}
+    fresh_status = {}
+    cache = open_cache(use_cache)
+    try:
+        if indexes:
+            with run_metrics.stage("fetch_stock_data"):
+                fresh.update(fetch_stock_data(cache, instruments=indexes, status=fresh_status))
+        if valuations:
+            with run_metrics.stage("fetch_pe_pb_xilv_data"):
+                fresh.update(fetch_pe_pb_xilv_data(cache, instruments=valuations, status=fresh_status))
+    finally:
+        if cache:
+            cache.close()
+
+    # 只替换恢复成功的指数的数值；仍失败的只更新状态中的错误信息与耗时
+    patched = {}
+    for (name, metric), entry in fresh_status.items():
+        if entry[0] != status_failed:
+            metrics = quote_metrics if metric == metric_price else valuation_metrics
+            patched.update(((name, m), fresh[(name, m)]) for m in metrics)
+    recovered = sum(entry[0] != status_failed for entry in fresh_status.values())
+    with run_metrics.stage("store_replace_last"):
+        store.replace_last(date, {**values, **patched}, time_text, {**status, **fresh_status})
+        matrix.replace_last(store)
+    print(f"恢复 {recovered} 个，仍失败 {len(fresh_status) - recovered} 个")
+    if not patched:
+        return
+
+    if os.path.exists(xlsx_path):
+        with run_metrics.stage("patch_xlsx"):
+            col = patch_snapshot_in_xlsx(xlsx_path, date, patched)
+        if col is None:
+            print(f"{xlsx_path} 的最后一列不是 {date} 的快照，未修补工作簿")
+    # 最新快照的数值已改变，增量分析状态作废，从头重算
+    if os.path.exists(analytics_state_path):
+        os.remove(analytics_state_path)
+    export_analytics()
+
+def export_analytics():
+    """增量更新滚动收益、回撤、估值 z 分数与排名，写入 stocks_analytics.xlsx"""
+    from analytics import update_analytics
+    from xlsx_writer import write_tables_xlsx
+    with run_metrics.stage("analytics"):
+        analytics, processed = update_analytics(
+            store_path, analytics_state_path, stocks_index.names(), pe_pb_xilv.names(), metric_price, metric_score,
+            seed_scores=lambda: {
+                name: [score for _, score in scores] for name, scores in backfilled_scores(first_snapshot_date()).items()
+            })
+        write_tables_xlsx(analytics_path, analytics.sheets())
+    print(f"分析结果已写入 {analytics_path}：本次处理 {processed} 个快照，累计 {analytics.snapshots} 个")
+
+def exported_snapshot_count(view):
+    """
+    工作簿中已有快照存储的前多少个快照。没有记录（旧版本写入或导入的工作簿）时按最后一列的日期判断，只把更晚日期的快照视为未导出。
+    """
+    import xlsx_writer
+    from xlsx_patch import export_state
+    count, last_date = export_state(xlsx_path, xlsx_writer.exported_name)
+    if count is not None:
+        return min(count, len(view))
+    count = len(view)
+    while last_date and count and view.row(count - 1)[0] > last_date:
+        count -= 1
+    return count
+
+def export_pending_snapshots():
+    """把快照存储中尚未导出的快照依次追加为工作簿的新列，重复运行不会重复追加；返回追加的列数"""
+    store = open_store()
     if not os.path.exists(xlsx_path):
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "StockData"
-    else:
-        wb = openpyxl.load_workbook(xlsx_path)
-        ws = wb.active
+        # 没有工作簿时一次流式写出全部快照，不逐列追加
+        rebuild_xlsx(store, xlsx_path)
+        with open_matrix(store).open() as view:
+            return len(view)
+    with open_matrix(store).open() as view:
+        total = len(view)
+        exported = exported_snapshot_count(view)
+        pending = [view.row(i) for i in range(exported, total)]
+    for i, (date, _, values) in enumerate(pending, start=exported + 1):
+        append_snapshot_to_xlsx(xlsx_path, date, values, exported=i)
+    return len(pending)
 
-    last_col = detect_last_col(ws)
-    target_col = last_col + 1
+def export_realtime_data(use_cache=True, force=False):
+    with run_metrics.stage("export_realtime_data"):
+        snapshot = fetch_realtime_data(use_cache, force)
+        if snapshot is None:
+            return
+        # 同时补上之前只运行 fetch 写入、尚未导出的快照
+        export_pending_snapshots()
+        export_analytics()
 
-    fetch_stock_data_to_ws(ws, target_col)
-    update_pe_pb_xilv_to_ws(ws, target_col)
-    set_column_style(ws, target_col)
+def should_run(force=False):
+    """定时任务入口的判断：没有任何市场处于交易日时跳过本次运行"""
+    if force:
+        return True
+    markets = open_markets()
+    if not markets:
+        print("今天各市场均休市，跳过本次运行（--force 强制运行）")
+        return False
+    print(f"交易中的市场: {', '.join(markets)}")
+    return True
 
-    wb.save(xlsx_path)
+def print_history(name, metric=None):
+    """
+    输出一个指数的全部历史点位或估值结果，只读取快照矩阵中的这一列；
+    估值结果之前先输出 stocks_history.snap 中回填的更早的每日数据。
+    同名的行情指数与估值指数用 metric 或 status_label 的“名称 估值”写法区分，都未指定时优先行情。
+    """
+    label_suffix = status_label("", metric_score)
+    if metric is None and name.endswith(label_suffix) and name not in stocks_index and name not in pe_pb_xilv:
+        name, metric = name[:-len(label_suffix)], metric_score
+    if metric is None:
+        metric = metric_price if name in stocks_index else metric_score
+    if name not in (stocks_index if metric == metric_price else pe_pb_xilv):
+        print(f"没有名为 {name} 的{'行情' if metric == metric_price else '估值'}指数")
+        return
+    key = (name, metric)
+    with open_matrix().open() as view:
+        rows = view.history(key)
+    if key[1] == metric_score:
+        rows = backfilled_scores(rows[0][0] if rows else None).get(name, []) + rows
+    for date, value in rows:
+        print(f"{date}\t{'缺失' if value is None else round(value, 2)}")
+
+def print_report(json_path=None):
+    """不访问网络，输出快照存储中最新一次的行情与估值结果"""
+    with open_matrix().open() as view:
+        if not len(view):
+            print("快照存储为空")
+            return
+        date, time_text, values = view.row(-1)
+    print(f"最新快照: {date} {time_text}")
+    for inst in stocks_index:
+        value = values.get((inst.name, metric_price))
+        print(f"  {inst.name}: {'缺失' if value is None else round(value, 2)}")
+    for inst in pe_pb_xilv:
+        value = values.get((inst.name, metric_score))
+        print(f"  {inst.name} 估值: {'缺失' if value is None else round(value, 2)}")
+    last = SnapshotStore(store_path).last_with_status()
+    status = last[3] if last else {}
+    for (name, metric), (state, error, _) in status.items():
+        if state == status_failed:
+            print(f"  抓取失败: {status_label(name, metric)}（{error}）")
+    if json_path:
+        import json
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "date": date,
+                "time": time_text,
+                "values": [{"name": name, "metric": metric, "value": value} for (name, metric), value in values.items()],
+                "status": [
+                    {"name": name, "metric": metric, "status": state, "error": error, "latency_ms": latency}
+                    for (name, metric), (state, error, latency) in status.items()
+                ],
+            }, f, ensure_ascii=False, indent=2)
 
 if __name__ == "__main__":
-    export_realtime_data()
-# End-911-2025.11.15.103433
+    parser = argparse.ArgumentParser(description="抓取指数行情与估值并写入 stocks_data.xlsx；不指定子命令时依次执行 fetch 与 export")
+    parser.add_argument("--no-cache", action="store_true", help="忽略本地响应缓存，全部重新请求")
+    parser.add_argument("--record", metavar="DIR", help="把每个响应录制到夹具目录")
+    parser.add_argument("--replay", metavar="DIR", help="不访问网络，从夹具目录回放响应")
+    parser.add_argument("--report", metavar="PATH", help="运行结束后写入 JSON 格式的运行报告")
+    parser.add_argument("--prometheus", metavar="PATH", help="运行结束后写入 Prometheus 文本格式的指标")
+    parser.add_argument("--force", action="store_true", help="休市日也抓取，且抓取结果与最新快照相同时也写入")
+    sub = parser.add_subparsers(dest="command")
+    fetch_cmd = sub.add_parser("fetch", help="抓取行情与估值，只写入快照存储")
+    fetch_cmd.add_argument("--universe", metavar="NAME", action="append", help="改为抓取 universes/NAME.txt 中的全部代码，可重复指定")
+    export_cmd = sub.add_parser("export", help="不抓取数据，把尚未导出的快照追加到 stocks_data.xlsx 并更新 stocks_analytics.xlsx")
+    export_cmd.add_argument("--rebuild", action="store_true", help="由快照存储重新生成整个 stocks_data.xlsx")
+    sub.add_parser("backfill", help="回填 pe_pb_xilv 全部代码的历史估值百分位")
+    report_cmd = sub.add_parser("report", help="不访问网络，输出最新快照")
+    report_cmd.add_argument("--json", metavar="PATH", help="同时把最新快照写入 JSON 文件")
+    report_cmd.add_argument("--history", metavar="NAME", help="改为输出一个指数的全部历史；“名称 估值”输出估值结果")
+    report_cmd.add_argument(
+        "--metric", choices=(metric_price, metric_score), help="与 --history 一起使用：输出点位或估值结果，默认优先点位")
+    sub.add_parser("rescore", help="不抓取数据，按当前 calc 权重重新计算历史估值结果")
+    refetch_cmd = sub.add_parser("refetch", help="只重新抓取最新快照中的失败项，原位修补快照与工作簿中的对应一列")
+    refetch_cmd.add_argument("--failed", action="store_true", required=True, help="重新抓取状态为 failed 的指数")
+    daemon_cmd = sub.add_parser("daemon", help="常驻进程，交易时段内定时轮询行情")
+    daemon_cmd.add_argument("--poll-interval", type=float, default=60.0, help="轮询间隔（秒）")
+    daemon_cmd.add_argument("--ring-size", type=int, default=1440, help="每个指数在内存中保留的样本数")
+    daemon_cmd.add_argument("--flush-interval", type=float, default=300.0, help="落盘间隔（秒）")
+    args = parser.parse_args()
+    if args.record:
+        from replay import RecordingTransport
+        transport = RecordingTransport(default_transport, args.record)
+    elif args.replay:
+        from replay import ReplayTransport
+        transport = ReplayTransport(args.replay)
+    try:
+        if args.command == "fetch":
+            if args.universe:
+                for name in args.universe:
+                    export_universe(name, use_cache=not args.no_cache)
+            elif should_run(args.force):
+                with run_metrics.stage("fetch_realtime_data"):
+                    fetch_realtime_data(use_cache=not args.no_cache, force=args.force)
+        elif args.command == "export":
+            with run_metrics.stage("export"):
+                if args.rebuild:
+                    rebuild_xlsx(open_store(), xlsx_path)
+                    export_analytics()
+                elif export_pending_snapshots():
+                    export_analytics()
+                else:
+                    print("工作簿中已有全部快照，没有需要导出的数据")
+        elif args.command == "backfill":
+            with run_metrics.stage("backfill_valuation_history"):
+                backfill_valuation_history()
+        elif args.command == "report":
+            if args.history:
+                print_history(args.history, args.metric)
+            else:
+                print_report(args.json)
+        elif args.command == "rescore":
+            with run_metrics.stage("rescore_history"):
+                rescore_history()
+        elif args.command == "refetch":
+            with run_metrics.stage("refetch_failed"):
+                refetch_failed(use_cache=not args.no_cache)
+        elif args.command == "daemon":
+            run_intraday_daemon(args.poll_interval, args.ring_size, args.flush_interval)
+        elif should_run(args.force):
+            export_realtime_data(use_cache=not args.no_cache, force=args.force)
+    finally:
+        if args.report:
+            run_metrics.write_json(args.report)
+        if args.prometheus:
+            run_metrics.write_prometheus(args.prometheus)
+# End-913-2026.10.17.122818
@@ -0,0 +1,218 @@
+import json
+import math
+import mmap
+import os
+import struct
+from array import array
+from datetime import datetime
+
+# --------------------------
+# 定长快照矩阵
+# --------------------------
+# 由快照存储派生的只读优化文件，便于按指数或按日期切片读取历史：
+#   文件头  b"STKMAT01" + uint32 列数 + uint32 键表长度 + uint64 已同步到的快照存储偏移
+#   键表    JSON [[名称, 指标], ...]，补齐到 8 字节对齐
+#   数据    float64 矩阵，每个快照一行：[日期 yyyymmdd, 运行时间 epoch 秒, 各键的数值...]，缺失为 NaN
+# 读取时整个文件 mmap 映射，取一个指数的历史或一个日期的全部指数只访问对应的数值，
+# 不解码其余快照；需要批量计算时可用 array() 得到 NumPy memmap。
+matrix_magic = b"STKMAT01"
+matrix_header = struct.Struct("<8sIIQ")
+# 每行开头的两列：日期与运行时间
+index_cols = 2
+
+def date_number(date):
+    try:
+        return float(datetime.strptime(str(date), "%Y/%m/%d").strftime("%Y%m%d"))
+    except ValueError:
+        return math.nan
+
+def date_text(number):
+    if math.isnan(number):
+        return ""
+    number = int(number)
+    return f"{number // 10000:04d}/{number // 100 % 100:02d}/{number % 100:02d}"
+
+def time_number(time):
+    try:
+        return datetime.fromisoformat(time).timestamp() if time else math.nan
+    except ValueError:
+        return math.nan
+
+def time_text(number):
+    return "" if math.isnan(number) else datetime.fromtimestamp(number).isoformat(timespec="seconds")
+
+class SnapshotMatrix:
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path) and os.path.getsize(self.path) >= matrix_header.size
+
+    def read_header(self):
+        """返回 (键列表, 数据起始偏移, 已同步到的快照存储偏移)"""
+        with open(self.path, "rb") as f:
+            magic, cols, keys_len, synced = matrix_header.unpack(f.read(matrix_header.size))
+            if magic != matrix_magic:
+                raise ValueError(f"{self.path} 不是快照矩阵文件")
+            keys = [tuple(k) for k in json.loads(f.read(keys_len).decode("utf-8"))]
+        return keys, padded(matrix_header.size + keys_len), synced
+
+    # ---------- 写入 ----------
+    def build(self, store):
+        """由快照存储整体重建：键为全部快照中出现过的 (名称, 指标)，按首次出现的顺序"""
+        keys = {}
+        groups = []
+        synced = store_size(store)
+        for _, synced, (date, time, values) in store.scan():
+            keys.update(dict.fromkeys(values))
+            groups.append((date, time, values))
+        keys = list(keys)
+        meta = json.dumps([list(k) for k in keys], ensure_ascii=False).encode("utf-8")
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(matrix_header.pack(matrix_magic, index_cols + len(keys), len(meta), synced))
+            f.write(meta.ljust(padded(matrix_header.size + len(meta)) - matrix_header.size, b" "))
+            for date, time, values in groups:
+                f.write(encode_row(keys, date, time, values))
+        os.replace(tmp, self.path)
+
+    def sync(self, store):
+        """
+        追加快照存储中尚未同步的快照；出现新的键或存储被截短时整体重建。
+        存储被原样大小改写（rescore 子命令）时无法察觉，调用方应显式 build()。
+        """
+        if not self.exists():
+            self.build(store)
+            return self
+        keys, _, synced = self.read_header()
+        size = store_size(store)
+        if size == synced:
+            return self
+        if size < synced or synced == 0:
+            self.build(store)
+            return self
+        rows = []
+        key_set = set(keys)
+        end = synced
+        for _, end, (date, time, values) in store.scan(synced):
+            if not key_set.issuperset(values):
+                self.build(store)
+                return self
+            rows.append(encode_row(keys, date, time, values))
+        if not rows:
+            return self
+        with open(self.path, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            f.write(b"".join(rows))
+            f.seek(0)
+            magic, cols, keys_len, _ = matrix_header.unpack(f.read(matrix_header.size))
+            f.seek(0)
+            f.write(matrix_header.pack(magic, cols, keys_len, end))
+        return self
+
+    def replace_last(self, store):
+        """
+        快照存储的最后一个快照被原位替换（refetch）后，改写矩阵最后一行并更新同步偏移。
+        调用前矩阵应已与替换前的存储同步；出现新的键或矩阵为空时整体重建。
+        """
+        last = store.last_with_status()
+        if not self.exists() or last is None:
+            self.build(store)
+            return self
+        keys, offset, _ = self.read_header()
+        date, time, values, _ = last
+        row_size = (index_cols + len(keys)) * 8
+        rows = (os.path.getsize(self.path) - offset) // row_size
+        if rows == 0 or not set(keys).issuperset(values):
+            self.build(store)
+            return self
+        with open(self.path, "r+b") as f:
+            f.seek(offset + (rows - 1) * row_size)
+            f.write(encode_row(keys, date, time, values))
+            f.seek(0)
+            magic, cols, keys_len, _ = matrix_header.unpack(f.read(matrix_header.size))
+            f.seek(0)
+            f.write(matrix_header.pack(magic, cols, keys_len, store_size(store)))
+        return self
+
+    # ---------- 读取 ----------
+    def open(self):
+        return MatrixView(self)
+
+    def array(self):
+        """NumPy memmap，形状为 (快照数, 2 + 键数)，只读"""
+        import numpy as np
+        keys, offset, _ = self.read_header()
+        cols = index_cols + len(keys)
+        rows = (os.path.getsize(self.path) - offset) // (cols * 8)
+        return np.memmap(self.path, dtype="<f8", mode="r", offset=offset, shape=(rows, cols))
+
+class MatrixView:
+    """mmap 映射的只读视图，用 with 语句使用"""
+
+    def __init__(self, matrix):
+        self.keys, offset, _ = matrix.read_header()
+        self.columns = {key: index_cols + i for i, key in enumerate(self.keys)}
+        self.cols = index_cols + len(self.keys)
+        self.file = open(matrix.path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.rows = (len(self.map) - offset) // (self.cols * 8)
+        self.data = memoryview(self.map)[offset:offset + self.rows * self.cols * 8].cast("d")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        self.data.release()
+        self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.rows
+
+    def dates(self):
+        return [date_text(v) for v in self.data[0::self.cols]]
+
+    def history(self, key):
+        """一个 (名称, 指标) 的全部历史：[(date, float 或 None), ...]"""
+        col = self.columns.get(key)
+        if col is None:
+            return []
+        values = self.data[col::self.cols]
+        return [(date_text(d), None if math.isnan(v) else v) for d, v in zip(self.data[0::self.cols], values)]
+
+    def row(self, index):
+        """第 index 个快照（支持负数）：(date, time, {(名称, 指标): float 或 None})"""
+        if index < 0:
+            index += self.rows
+        if not 0 <= index < self.rows:
+            raise IndexError(index)
+        row = self.data[index * self.cols:(index + 1) * self.cols]
+        values = {key: (None if math.isnan(v) else v) for key, v in zip(self.keys, row[index_cols:])}
+        return date_text(row[0]), time_text(row[1]), values
+
+    def on_date(self, date):
+        """某一日期的全部快照（同一天可能运行多次）"""
+        target = date_number(date)
+        return [self.row(i) for i, d in enumerate(self.data[0::self.cols]) if d == target]
+
+    def __iter__(self):
+        for i in range(self.rows):
+            yield self.row(i)
+
+def padded(size):
+    return (size + 7) // 8 * 8
+
+def store_size(store):
+    return os.path.getsize(store.path) if store.exists() else 0
+
+def encode_row(keys, date, time, values):
+    return array("d", (
+        date_number(date),
+        time_number(time),
+        *(math.nan if values.get(key) is None else float(values[key]) for key in keys),
+    )).tobytes()
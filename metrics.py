@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# --------------------------
+# 运行指标
+# --------------------------
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class RunMetrics:
+    """
+    记录一次运行的各阶段耗时，以及按数据源统计的请求延迟、传输字节、失败、重试与缓存命中。
+    抓取线程会并发调用 record_*，内部用锁保护。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = datetime.now().isoformat(timespec="seconds")
+            self.stages = {}
+            self.providers = {}
+
+    def provider_stats(self, provider):
+        return self.providers.setdefault(provider, {
+            "requests": 0,
+            "failures": 0,
+            "retries": 0,
+            "bytes": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "latencies": [],
+        })
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                stats = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+                stats["calls"] += 1
+                stats["seconds"] += elapsed
+
+    def record_request(self, provider, seconds, size, ok=True):
+        with self.lock:
+            stats = self.provider_stats(provider)
+            stats["requests"] += 1
+            stats["bytes"] += size
+            stats["latencies"].append(seconds)
+            if not ok:
+                stats["failures"] += 1
+
+    def record_retry(self, provider):
+        with self.lock:
+            self.provider_stats(provider)["retries"] += 1
+
+    def record_cache(self, provider, hits, misses):
+        with self.lock:
+            stats = self.provider_stats(provider)
+            stats["cache_hits"] += hits
+            stats["cache_misses"] += misses
+
+    def report(self):
+        with self.lock:
+            providers = {}
+            for name, stats in self.providers.items():
+                latencies = sorted(stats["latencies"])
+                providers[name] = {
+                    **{k: v for k, v in stats.items() if k != "latencies"},
+                    "latency_seconds": {
+                        "total": round(sum(latencies), 4),
+                        "p50": round(percentile(latencies, 0.5), 4),
+                        "p95": round(percentile(latencies, 0.95), 4),
+                        "max": round(latencies[-1], 4) if latencies else 0.0,
+                    },
+                }
+            return {
+                "started_at": self.started_at,
+                "stages": {k: {"calls": v["calls"], "seconds": round(v["seconds"], 4)} for k, v in self.stages.items()},
+                "providers": providers,
+            }
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        report = self.report()
+        lines = [
+            "# HELP stocks_stage_seconds Wall time spent in each stage of the run.",
+            "# TYPE stocks_stage_seconds gauge",
+        ]
+        for name, stats in report["stages"].items():
+            lines.append(f'stocks_stage_seconds{{stage="{name}"}} {stats["seconds"]}')
+        counters = [
+            ("requests", "stocks_provider_requests_total", "HTTP requests sent per provider."),
+            ("failures", "stocks_provider_failures_total", "Failed HTTP attempts per provider."),
+            ("retries", "stocks_provider_retries_total", "Retried HTTP attempts per provider."),
+            ("bytes", "stocks_provider_bytes_total", "Response bytes received per provider."),
+            ("cache_hits", "stocks_provider_cache_hits_total", "Symbols served from the response cache."),
+            ("cache_misses", "stocks_provider_cache_misses_total", "Symbols not found in the response cache."),
+        ]
+        for key, metric, help_text in counters:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, stats in report["providers"].items():
+                lines.append(f'{metric}{{provider="{name}"}} {stats[key]}')
+        lines.append("# HELP stocks_provider_latency_seconds Request latency per provider.")
+        lines.append("# TYPE stocks_provider_latency_seconds gauge")
+        for name, stats in report["providers"].items():
+            for q in ("p50", "p95", "max"):
+                lines.append(f'stocks_provider_latency_seconds{{provider="{name}",quantile="{q}"}} {stats["latency_seconds"][q]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+
+run_metrics = RunMetrics()
@@ -0,0 +1,459 @@
+import hashlib
+import json
+import re
+import time
+from bisect import bisect_left, insort
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+# --------------------------
+# 请求头
+# --------------------------
+browser_headers = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:145.0) Gecko/20100101 Firefox/145.0",
+    "Accept": "*/*",
+    "Accept-Language": "zh-CN",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "Sec-Fetch-Storage-Access": "none",
+    "DNT": "1",
+    "Sec-GPC": "1",
+    "Connection": "keep-alive",
+    "Referer": "https://finance.sina.com.cn/",
+    "Sec-Fetch-Dest": "script",
+    "Sec-Fetch-Mode": "no-cors",
+    "Sec-Fetch-Site": "cross-site",
+}
+
+# --------------------------
+# 数据源注册表
+# --------------------------
+provider_registry = {}
+
+def register_provider(cls):
+    provider_registry[cls.name] = cls()
+    return cls
+
+def get_provider(name):
+    try:
+        return provider_registry[name]
+    except KeyError:
+        raise KeyError(f"未知的数据源: {name}") from None
+
+class Provider:
+    """
+    数据源适配器：声明代码格式、分批方式、请求构造、响应解析以及自身的限流参数。
+    抓取引擎只依赖这些接口，新增数据源无需改动抓取循环。
+    """
+    name = ""
+    batch_size = 1      # 每次请求最多包含的代码数
+    concurrency = 2     # 同时进行的请求数
+    interval = 1.0      # 相邻请求的最小发起间隔（秒）
+    cache_ttl = 0       # 本地缓存有效期（秒），0 表示不缓存
+    fast_path = False   # 是否走 asynchttp 轻量客户端（小文本响应的行情接口）
+    encoding = "utf-8"  # 响应头未声明 charset 时的解码方式
+
+    def symbol(self, code):
+        """配置中的 code 转为接口使用的代码"""
+        return code
+
+    def batches(self, symbols):
+        for i in range(0, len(symbols), self.batch_size):
+            yield symbols[i:i + self.batch_size]
+
+    def prepare(self, symbols):
+        """每次抓取前对本次全部待请求的代码调用一次，可预先计算请求；默认不做任何事"""
+
+    def build_request(self, symbols):
+        """返回 (method, url, headers, body)"""
+        raise NotImplementedError
+
+    def parse(self, content, symbols):
+        """解析响应体（bytes 或 memoryview），返回 {代码: 结果}"""
+        raise NotImplementedError
+
+# --------------------------
+# 行情数据源
+# --------------------------
+# 行情接口统一返回 Quote：最新价、涨跌额、涨跌幅（%）、成交量，接口未给出的字段为 None
+Quote = namedtuple("Quote", ("price", "change", "pct_change", "volume"))
+
+def number(field):
+    """bytes 字段转 float，空字段或无法解析时为 None；float() 直接接受 ASCII bytes，无需解码"""
+    try:
+        return float(field)
+    except (TypeError, ValueError):
+        return None
+
+def to_quote(price, change, pct_change, volume):
+    # 绝大多数字段是数字或空，先不逐个捕获异常；遇到非数字字段再逐个解析
+    try:
+        return Quote(
+            float(price) if price else None,
+            float(change) if change else None,
+            float(pct_change) if pct_change else None,
+            float(volume) if volume else None,
+        )
+    except ValueError:
+        return Quote(number(price), number(change), number(pct_change), number(volume))
+
+@register_provider
+class GtimgProvider(Provider):
+    name = "gtimg"
+    batch_size = 60
+    concurrency = 4
+    interval = 0.2
+    cache_ttl = 300
+    fast_path = True
+    encoding = "gbk"
+    base_url = "https://qt.gtimg.cn/?q="
+    # v_s_sh000001="1~上证指数~000001~3888.08~-12.34~-0.32~303862107~...";
+    # 以 ~ 分隔：市场、名称、代码、最新价、涨跌额、涨跌幅、成交量（手）。
+    # 名称为 GBK，不解码直接跳过；GBK 双字节字符的第二个字节可能是 ~（0x7E，例如“亊”），
+    # 因此名称按字符匹配：ASCII 单字节或首字节 0x81-0xFE 加第二个字节成对跳过，不会在字符中间断开。
+    # 代码字段只含 ASCII 字母数字与点，对不齐时整条记录不匹配，由抓取引擎记为失败而不是错位解析。
+    pattern = re.compile(
+        rb'v_([\w.]+)="[^"~]*~(?:[^"~\x80-\xff]|[\x81-\xfe][\x40-\xfe])*~[\w.]*~([^"~]*)'
+        rb'(?:~([^"~]*))?(?:~([^"~]*))?(?:~([^"~]*))?')
+
+    def symbol(self, code):
+        return "s_" + code
+
+    def build_request(self, symbols):
+        return "GET", self.base_url + ",".join(symbols), browser_headers, None
+
+    def parse(self, content, symbols):
+        # findall 直接返回各字段的 bytes 切片，不拆分整条记录
+        return {
+            symbol.decode("ascii"): to_quote(price, change, pct_change, volume)
+            for symbol, price, change, pct_change, volume in self.pattern.findall(content)
+        }
+
+@register_provider
+class XueqiuProvider(Provider):
+    name = "xueqiu"
+    concurrency = 2
+    interval = 0.5
+    cache_ttl = 300
+    base_url = "https://stock.xueqiu.com/v5/stock/realtime/quotec.json?symbol="
+
+    def build_request(self, symbols):
+        return "GET", self.base_url + symbols[0], browser_headers, None
+
+    def parse(self, content, symbols):
+        # 解析 xueqiu.com 的 JSON 响应，提取 current / chg / percent / volume
+        quote = json.loads(content)["data"][0]
+        return {symbols[0]: Quote(quote["current"], quote.get("chg"), quote.get("percent"), quote.get("volume"))}
+
+@register_provider
+class SinaProvider(Provider):
+    name = "sina"
+    batch_size = 60
+    concurrency = 2
+    interval = 0.3
+    cache_ttl = 300
+    fast_path = True
+    encoding = "gbk"
+    base_url = "https://w.sinajs.cn/list="
+    # var hq_str_znb_SENSEX="名称,最新价,涨跌额,涨跌幅,时间,...";
+    # 以 , 分隔，GBK 双字节字符的第二个字节不会是 , 或 "，名称可直接跳过；全球指数接口不提供成交量
+    pattern = re.compile(rb'hq_str_([\w.]+)="[^",]*,([^",]*)(?:,([^",]*))?(?:,([^",]*))?')
+
+    def symbol(self, code):
+        return "znb_" + code
+
+    def build_request(self, symbols):
+        return "GET", self.base_url + ",".join(symbols), browser_headers, None
+
+    def parse(self, content, symbols):
+        results = {}
+        for symbol, price, change, pct_change in self.pattern.findall(content):
+            quote = to_quote(price, change, pct_change, b"")
+            if quote.price is not None:
+                results[symbol.decode("ascii")] = quote
+        return results
+
+# --------------------------
+# 估值数据源（PE / PB / Xilv）
+# --------------------------
+# 签名字段表：(字段名, 起, 止)，值为 MD5 十六进制串的切片，顺序即请求体中的字段顺序
+signature_slices = (
+    ("yi854tew", 29, 31),
+    ("u54rg5d", 2, 4),
+    ("bioduytlw", 5, 6),
+    ("nkjhrew", 26, 27),
+    ("bvytikwqjk", 6, 8),
+    ("tiklsktr4", 1, 2),
+    ("tirgkjfs", 0, 2),
+    ("bgd7h8tyu54", 6, 8),
+    ("yt447e13f", 8, 9),
+    ("nd354uy4752", 30, 31),
+    ("ghtoiutkmlg", 11, 14),
+    ("y654b5fs3tr", 11, 12),
+    ("fjlkatj", 2, 5),
+    ("jnhf8u5231", 9, 11),
+    ("sbnoywr", 23, 25),
+    ("kf54ge7", 31, 32),
+    ("hy5641d321t", 25, 27),
+    ("bgiuytkw", 9, 11),
+    ("quikgdky", 27, 29),
+    ("ngd4uy551", 17, 19),
+    ("bd4uy742", 26, 27),
+    ("ngd4yut78", 12, 14),
+    ("iogojti", 25, 26),
+    ("h67456y", 16, 19),
+    ("lksytkjh", 17, 21),
+    ("n3bf4uj7y7", 18, 19),
+    ("nbf4uj7y432", 21, 23),
+    ("ibvytiqjek", 14, 16),
+    ("h13ey474", 29, 32),
+    ("abiokytke", 21, 23),
+    ("bd24y6421f", 24, 26),
+    ("tbvdiuytk", 16, 17),
+)
+sign_version = "2.2.7"
+sign_salt = "EWf45rlv#kfsr@k#gfksgkr"
+
+def static_fields(gu_code, pe_category, ts):
+    return {
+        "gu_code": gu_code,
+        "pe_category": pe_category,
+        "year": -1,
+        "category": "",
+        "ver": "new",
+        "type": "pc",
+        "version": sign_version,
+        "authtoken": "",
+        "act_time": ts,
+    }
+
+def split_md5(md5_string, ts, gu_code, pe_category="pe"):
+    fields = static_fields(gu_code, pe_category, ts)
+    fields.update((key, md5_string[a:b]) for key, a, b in signature_slices)
+    return fields
+
+class RequestSigner:
+    """
+    预先计算 jiucaishuo 请求体中不变的部分：字段顺序、静态字段与切片表编码为一个 % 格式模板，
+    每次签名只计算 MD5，再填入 gu_code、act_time 与切片值，结果与 json.dumps(split_md5(...)) 逐字节相同。
+    """
+
+    def __init__(self):
+        self.templates = {}
+        self.slices = tuple(slice(a, b) for _, a, b in signature_slices)
+
+    def template(self, pe_category):
+        # 每个估值类别一个模板；gu_code 与 act_time 用占位值编码后替换为 %s / %d
+        template = self.templates.get(pe_category)
+        if template is None:
+            fields = static_fields("\0gu_code", pe_category, -999)
+            fields.update((key, "\0slice") for key, _, _ in signature_slices)
+            text = json.dumps(fields).replace("%", "%%")
+            text = text.replace(json.dumps("\0gu_code"), "%s").replace("-999", "%d").replace(json.dumps("\0slice"), '"%s"')
+            template = self.templates[pe_category] = text
+        return template
+
+    def sign(self, gu_code, pe_category="pe", ts=None):
+        if ts is None:
+            ts = int(time.time() * 1000)
+        # 签名串：时间戳 + 代码 + 估值类别 + type(pc) + ver(new) + version + year(-1) + 盐
+        md5_value = hashlib.md5(f"{ts}{gu_code}{pe_category}pcnew{sign_version}-1{sign_salt}".encode("utf-8")).hexdigest()
+        return self.template(pe_category) % (json.dumps(gu_code), ts, *[md5_value[s] for s in self.slices])
+
+    def sign_many(self, requests, ts=None):
+        """requests: [(gu_code, pe_category), ...]，共用同一个时间戳，返回同顺序的请求体列表"""
+        if ts is None:
+            ts = int(time.time() * 1000)
+        return [self.sign(gu_code, pe_category, ts) for gu_code, pe_category in requests]
+
+def parse_percent(s):
+    """解析 "12.34%" 之类的字符串；缺失或无法解析时返回 None，与真实的 0 区分"""
+    if s is None:
+        return None
+    try:
+        text = str(s).replace('%', '').strip()
+        return round(float(text), 2) if text else None
+    except ValueError:
+        return None
+
+@register_provider
+class JiucaishuoProvider(Provider):
+    """
+    估值接口，每次请求一个代码，返回 (point, pe, pb, xilv)。
+    接口未给出的字段为 None。
+    """
+    name = "jiucaishuo"
+    concurrency = 4
+    interval = 0.25
+    # 估值百分位每天最多变化一次
+    cache_ttl = 12 * 3600
+    url = "https://api.jiucaishuo.com/v2/guzhi/newtubiaodata"
+
+    request_headers = {
+        "Host": "api.jiucaishuo.com",
+        "Content-Type": "application/json;charset=UTF-8",
+        "User-Agent": browser_headers["User-Agent"],
+    }
+
+    signer = RequestSigner()
+    # prepare() 预先签好的请求体在这段时间（秒）内有效，过期或重试时重新签名
+    presign_ttl = 30.0
+    presigned = {}
+
+    def signing_args(self, symbol):
+        """返回 (gu_code, pe_category)"""
+        return symbol, "pe"
+
+    def signed_body(self, gu_code, pe_category="pe"):
+        return self.signer.sign(gu_code, pe_category)
+
+    def prepare(self, symbols):
+        # 在分发到抓取线程之前一次性签好全部请求体，线程内只取用
+        bodies = self.signer.sign_many([self.signing_args(symbol) for symbol in symbols])
+        now = time.monotonic()
+        self.presigned.update((symbol, (now, body)) for symbol, body in zip(symbols, bodies))
+
+    def build_request(self, symbols):
+        signed_at, body = self.presigned.pop(symbols[0], (None, None))
+        if signed_at is None or time.monotonic() - signed_at > self.presign_ttl:
+            body = self.signed_body(*self.signing_args(symbols[0]))
+        return "POST", self.url, self.request_headers, body
+
+    def parse(self, content, symbols):
+        data = json.loads(content)
+        # 取 new_percent_value 中的百分比数字并转 float
+        top_data = (data.get('data') or {}).get('top_data') or []
+
+        def field(i, key):
+            if i < len(top_data) and isinstance(top_data[i], dict):
+                return (top_data[i].get(key) or {}).get('value')
+            return None
+        point = parse_percent(field(0, 'new_value'))
+        pe = parse_percent(field(1, 'new_percent_value'))
+        pb = parse_percent(field(2, 'new_percent_value'))
+        xilv = parse_percent(field(3, 'new_percent_value'))
+        return {symbols[0]: (point, pe, pb, xilv)}
+
+def expanding_percentiles(values):
+    """每个位置的值在其之前（含自身）全部历史中的百分位，0~100，保留两位小数"""
+    seen = []
+    result = []
+    for value in values:
+        below = bisect_left(seen, value)
+        insort(seen, value)
+        result.append(round(below / (len(seen) - 1) * 100, 2) if len(seen) > 1 else 0.0)
+    return result
+
+def chart_date(value):
+    """图表横轴可能是 "2020-01-02" 字符串或毫秒时间戳，统一为 2020/01/02 格式"""
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000, timezone(timedelta(hours=8))).strftime("%Y/%m/%d")
+    return str(value)[:10].replace("-", "/")
+
+class ChartFormatError(ValueError):
+    """历史图表的响应无法按预期的字段解析"""
+
+chart_date_text = re.compile(r"\d{4}[-/]\d{2}[-/]\d{2}")
+
+def looks_like_date(value):
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        # 毫秒时间戳
+        return value > 1e11
+    return isinstance(value, str) and chart_date_text.match(value) is not None
+
+def chart_axis(node):
+    """字典 node 中的日期轴：元素全部为日期的列表，可以包在 {"data": [...]} 里"""
+    for value in node.values():
+        if isinstance(value, dict):
+            value = value.get("data")
+        if isinstance(value, list) and value and all(looks_like_date(v) for v in value):
+            return value
+    return None
+
+def iter_chart_series(node):
+    """
+    在响应中按结构查找图表序列，逐个 yield (序列名, [(日期原值, 数值原值), ...])。
+    序列是带 data 列表的字典；data 的元素为 [日期, 数值] 时自带日期，否则与同一层等长的日期轴对应。
+    """
+    if isinstance(node, list):
+        children = node
+    elif isinstance(node, dict):
+        axis = chart_axis(node)
+        for value in node.values():
+            if not (isinstance(value, list) and value
+                    and all(isinstance(s, dict) and isinstance(s.get("data"), list) for s in value)):
+                continue
+            for series in value:
+                data = series["data"]
+                if data and all(isinstance(p, (list, tuple)) and len(p) >= 2 and looks_like_date(p[0]) for p in data):
+                    yield str(series.get("name", "")), [(p[0], p[-1]) for p in data]
+                elif axis is not None and len(axis) == len(data):
+                    yield str(series.get("name", "")), list(zip(axis, data))
+        children = node.values()
+    else:
+        return
+    for child in children:
+        if isinstance(child, (dict, list)):
+            yield from iter_chart_series(child)
+
+@register_provider
+class JiucaishuoHistoryProvider(JiucaishuoProvider):
+    """
+    估值接口响应中的历史图表，用于回填。请求与日常抓取完全相同（pe 类别、year=-1），每个代码一次；
+    返回 {指标: [(date, 百分位), ...]}，指标为 pe / pb / xilv 中图表里出现的那些。
+    图表的字段名没有公开，按结构查找序列（见 iter_chart_series），按序列名区分指标；
+    名称带“分位”的序列直接作为百分位，否则由估值序列按扩展窗口计算。
+    找不到任何序列时抛出 ChartFormatError，消息中带上响应里的键，不会当作“没有历史”静默跳过。
+    """
+    name = "jiucaishuo_history"
+    cache_ttl = 0
+    percentile_marker = "分位"
+    # 序列名中的关键字 → 指标；没有可识别名称的唯一序列按请求的 pe 类别处理
+    metric_markers = (("pb", ("市净率", "PB")), ("xilv", ("股息率", "息率")), ("pe", ("市盈率", "PE")))
+
+    presigned = {}
+
+    def series_metric(self, name):
+        for metric, markers in self.metric_markers:
+            if any(marker in name for marker in markers):
+                return metric
+        return None
+
+    def parse(self, content, symbols):
+        response = json.loads(content)
+        found = list(iter_chart_series(response))
+        named = [(self.series_metric(name), name, data) for name, data in found]
+        if not any(metric for metric, _, _ in named) and len(found) == 1:
+            named = [("pe", found[0][0], found[0][1])]
+        chosen = {}
+        for metric, name, data in named:
+            if metric is None:
+                continue
+            percentile = self.percentile_marker in name
+            # 同一指标有百分位序列时优先使用
+            if metric not in chosen or (percentile and not chosen[metric][0]):
+                chosen[metric] = (percentile, data)
+        if not chosen:
+            raise ChartFormatError(
+                f"{symbols[0]} 的响应中没有可识别的估值图表序列；"
+                f"找到的序列 {[name for name, _ in found]}，"
+                f"响应的键 {sorted(response) if isinstance(response, dict) else type(response).__name__}，"
+                f"data 的键 {sorted(response['data']) if isinstance(response, dict) and isinstance(response.get('data'), dict) else None}")
+
+        result = {}
+        for metric, (percentile, data) in chosen.items():
+            points = []
+            for date, value in data:
+                value = parse_percent(value)
+                if value is not None:
+                    points.append((chart_date(date), value))
+            if not points:
+                continue
+            if not percentile:
+                percentiles = expanding_percentiles([v for _, v in points])
+                points = [(date, p) for (date, _), p in zip(points, percentiles)]
+            result[metric] = points
+        if not result:
+            raise ChartFormatError(f"{symbols[0]} 的图表序列中没有可解析的数值")
+        return {symbols[0]: result}
@@ -0,0 +1,103 @@
+import json
+
+# --------------------------
+# 指数登记表
+# --------------------------
+# 配置来自 instruments.json，加载后只读：每个指数是一个 __slots__ 记录，
+# 抓取结果另行保存，多个线程可以同时读取登记表而不需要加锁。
+class Instrument:
+    __slots__ = ("index", "name", "code", "provider", "row", "calc", "rewrite_row")
+
+    def __init__(self, index, name, code, provider=None, row=0, calc=(), rewrite_row=0):
+        for field, value in zip(self.__slots__, (index, name, code, provider, row, tuple(calc), rewrite_row)):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, field, value):
+        raise AttributeError(f"Instrument 只读，不能修改 {field}")
+
+    def __delattr__(self, field):
+        raise AttributeError(f"Instrument 只读，不能删除 {field}")
+
+    def __repr__(self):
+        return f"Instrument({self.name!r}, code={self.code!r}, row={self.row})"
+
+class Registry:
+    """按配置顺序保存的只读指数序列，可按名称查找"""
+    __slots__ = ("instruments", "by_name")
+
+    def __init__(self, instruments):
+        object.__setattr__(self, "instruments", tuple(instruments))
+        object.__setattr__(self, "by_name", {inst.name: inst for inst in self.instruments})
+        if len(self.by_name) != len(self.instruments):
+            raise ValueError("登记表中存在重复的名称")
+
+    def __setattr__(self, field, value):
+        raise AttributeError("Registry 只读")
+
+    def __iter__(self):
+        return iter(self.instruments)
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def names(self):
+        return [inst.name for inst in self.instruments]
+
+def build_registry(entries, start_row, stride, default_provider=None):
+    """row 为 0 或省略的条目从 start_row 起按 stride 自动编号"""
+    instruments = []
+    next_row = start_row
+    for i, entry in enumerate(entries):
+        row = entry.get("row", 0)
+        if row == 0:
+            row = next_row
+            next_row += stride
+        instruments.append(Instrument(
+            i,
+            entry["name"],
+            entry["code"],
+            provider=entry.get("provider", default_provider),
+            row=row,
+            calc=entry.get("calc", ()),
+            rewrite_row=entry.get("rewrite_row", 0),
+        ))
+    return Registry(instruments)
+
+def load_universe(path, default_provider=None):
+    """
+    读取成分股列表：每行一个代码，代码后的内容（如名称）忽略，# 开头为注释；
+    `# provider: 名称` 指定整个列表的数据源。名称即代码，不占用工作簿行号。
+    """
+    provider = default_provider
+    entries = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#"):
+                key, _, value = line[1:].partition(":")
+                if key.strip() == "provider" and value.strip():
+                    provider = value.strip()
+                continue
+            if not line:
+                continue
+            code = line.split()[0]
+            if code not in seen:
+                seen.add(code)
+                entries.append({"name": code, "code": code})
+    return build_registry(entries, 0, 0, default_provider=provider)
+
+def load_registry(path):
+    """读取 instruments.json，返回 (行情登记表, 估值登记表)"""
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    layout = config["layout"]
+    stocks_index = build_registry(config["stocks_index"], layout["index_start_row"], layout["row_stride"])
+    pe_pb_xilv = build_registry(config["pe_pb_xilv"], layout["valuation_start_row"], layout["row_stride"])
+    return stocks_index, pe_pb_xilv
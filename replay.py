@@ -0,0 +1,194 @@
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from asynchttp import Headers, Response
+
+# --------------------------
+# 录制 / 回放
+# --------------------------
+# 抓取引擎通过 transport(provider, batch, method, url, headers, body) 发请求并得到响应
+# （requests.Response 或接口相同的 asynchttp.Response）。回放只用标准库，不依赖 requests。
+# 这里的几种 transport 把真实响应录制为夹具文件，或在离线时从夹具文件回放，
+# 夹具按 (数据源, 本批代码) 命名，与请求体中的时间戳、签名等易变字段无关。
+fixture_key_header = "X-Fixture-Key"
+
+class FixtureMissing(LookupError):
+    pass
+
+def fixture_key(provider_name, batch):
+    digest = hashlib.sha1(f"{provider_name}:{','.join(batch)}".encode("utf-8")).hexdigest()[:16]
+    return f"{provider_name}/{digest}"
+
+def fixture_path(fixture_dir, key):
+    return os.path.join(fixture_dir, key + ".json")
+
+def save_fixture(fixture_dir, provider_name, batch, method, url, response):
+    key = fixture_key(provider_name, batch)
+    path = fixture_path(fixture_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fixture = {
+        "provider": provider_name,
+        "symbols": list(batch),
+        "method": method,
+        "url": url,
+        "status": response.status_code,
+        "encoding": response.encoding,
+        "content_type": response.headers.get("Content-Type", ""),
+        "body": base64.b64encode(response.content).decode("ascii"),
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(fixture, f, ensure_ascii=False, indent=1)
+
+def load_fixture(fixture_dir, key):
+    path = fixture_path(fixture_dir, key)
+    if not os.path.exists(path):
+        raise FixtureMissing(f"没有录制的响应: {key}")
+    with open(path, encoding="utf-8") as f:
+        fixture = json.load(f)
+    fixture["body"] = base64.b64decode(fixture["body"])
+    return fixture
+
+def iter_fixtures(fixture_dir):
+    for root, _, files in os.walk(fixture_dir):
+        for name in sorted(files):
+            if name.endswith(".json"):
+                key = os.path.relpath(os.path.join(root, name), fixture_dir)[:-len(".json")].replace(os.sep, "/")
+                yield load_fixture(fixture_dir, key)
+
+def build_response(fixture, url=None):
+    headers = Headers()
+    headers["Content-Type"] = fixture.get("content_type", "")
+    try:
+        reason = HTTPStatus(fixture["status"]).phrase
+    except ValueError:
+        reason = ""
+    response = Response(fixture["status"], reason, headers, fixture["body"], url or fixture["url"])
+    # 按录制时实际使用的编码解码，与响应头中的 charset 无关
+    response.encoding = fixture["encoding"] or response.encoding
+    return response
+
+class RecordingTransport:
+    """透传到真实 transport，同时把每个响应保存为夹具"""
+
+    def __init__(self, inner, fixture_dir):
+        self.inner = inner
+        self.fixture_dir = fixture_dir
+
+    def __call__(self, provider, batch, method, url, headers, body):
+        response = self.inner(provider, batch, method, url, headers, body)
+        save_fixture(self.fixture_dir, provider.name, batch, method, url, response)
+        return response
+
+class ReplayTransport:
+    """进程内回放夹具，可选注入延迟与错误"""
+
+    def __init__(self, fixture_dir, latency=0.0, error_rate=0.0, seed=None):
+        self.fixture_dir = fixture_dir
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    def __call__(self, provider, batch, method, url, headers, body):
+        fixture = load_fixture(self.fixture_dir, fixture_key(provider.name, batch))
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise ConnectionError("注入的连接错误")
+        return build_response(fixture, url)
+
+# --------------------------
+# 本地桩服务器
+# --------------------------
+class StubServer:
+    """
+    在 127.0.0.1 上提供夹具的 HTTP 服务，用于在真实网络栈（连接池、并发、重试）下做基准测试。
+    latency 为每个请求的固定延迟（秒），error_rate 为返回 503 的概率。
+    """
+
+    def __init__(self, fixture_dir, latency=0.0, error_rate=0.0, seed=None):
+        self.fixture_dir = fixture_dir
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 响应头与响应体分两次写出，关闭 Nagle 以免每个响应多等一个延迟 ACK（约 40ms）
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server.handle(self)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.rfile.read(length)
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle(self, handler):
+        with self.lock:
+            self.requests += 1
+            fail = self.error_rate and self.random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            fixture = load_fixture(self.fixture_dir, handler.headers.get(fixture_key_header, ""))
+            status, body = (503, b"injected error") if fail else (fixture["status"], fixture["body"])
+            content_type = fixture.get("content_type") or "text/plain"
+            if "charset" not in content_type and fixture.get("encoding"):
+                # 保证客户端按录制时的编码解码
+                content_type += f"; charset={fixture['encoding']}"
+        except FixtureMissing as e:
+            status, body, content_type = 404, str(e).encode("utf-8"), "text/plain; charset=utf-8"
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class StubTransport:
+    """把请求改发到 StubServer；session 为 requests 会话或 asynchttp 客户端，二者 request() 参数一致"""
+
+    def __init__(self, session, server_url, timeout=10):
+        self.session = session
+        self.server_url = server_url
+        self.timeout = timeout
+
+    def __call__(self, provider, batch, method, url, headers, body):
+        parts = urlsplit(url)
+        target = self.server_url + parts.path + (f"?{parts.query}" if parts.query else "")
+        request_headers = {k: v for k, v in headers.items() if k.lower() != "host"}
+        request_headers[fixture_key_header] = fixture_key(provider.name, batch)
+        return self.session.request(method, target, headers=request_headers, data=body, timeout=self.timeout)
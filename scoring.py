@@ -0,0 +1,66 @@
+import numpy as np
+
+# --------------------------
+# 批量估值打分
+# --------------------------
+# 快照中保存了每个指数每次运行的原始 pe / pb / 息率百分位，
+# calc 权重调整后可以对全部指数、全部历史日期一次性重新计算加权结果，无需重新请求接口。
+component_metrics = ("pe", "pb", "xilv")
+
+def percentile_matrix(snapshots, names):
+    """
+    返回 (快照列表, 矩阵)，矩阵形状为 (3, 指数数, 快照数)，缺失为 NaN。
+    快照列表保留 (date, time, values) 原样，便于写回。
+    """
+    snapshots = list(snapshots)
+    matrix = np.full((len(component_metrics), len(names), len(snapshots)), np.nan)
+    for j, (_, _, values) in enumerate(snapshots):
+        for i, name in enumerate(names):
+            for k, metric in enumerate(component_metrics):
+                value = values.get((name, metric))
+                if value is not None:
+                    matrix[k, i, j] = value
+    return snapshots, matrix
+
+def weighted_scores(matrix, weights):
+    """
+    matrix: (3, 指数数, 快照数) 的百分位；weights: (指数数, 3) 的 calc 权重。
+    权重为 0 的分量忽略，权重非 0 的分量缺失时结果为 NaN；不做舍入。
+    按 pe、pb、息率的顺序逐个相加，与 calc_valuation_score 的累加结果逐位相同。
+    """
+    w = np.asarray(weights, dtype=float).T[:, :, None]
+    used = np.broadcast_to(w != 0, matrix.shape)
+    scores = np.where(used, np.nan_to_num(matrix) * w, 0.0).sum(axis=0)
+    scores[np.any(used & np.isnan(matrix), axis=0)] = np.nan
+    return scores
+
+def rescore_snapshots(snapshots, calc_by_name, score_metric="score"):
+    """
+    按 calc_by_name（{名称: [pe, pb, xilv 权重]}）重新计算所有快照的加权结果。
+    完全没有原始百分位的快照（例如从旧工作簿导入的历史）保留原有结果；
+    有百分位但缺少新权重需要的分量时结果为 None，与 calc_valuation_score 一致。
+    返回 (新的快照列表, 更新的单元格数)。
+    """
+    names = list(calc_by_name)
+    snapshots, matrix = percentile_matrix(snapshots, names)
+    scores = weighted_scores(matrix, [calc_by_name[name] for name in names])
+    changed = 0
+    result = []
+    for j, (date, time, values) in enumerate(snapshots):
+        values = dict(values)
+        for i, name in enumerate(names):
+            score = scores[i, j]
+            if np.isnan(score):
+                if np.all(np.isnan(matrix[:, i, j])):
+                    continue
+                score = None
+            else:
+                # np.round 先乘 100 再取整，与 Python round 的结果不一定相同；
+                # 用 round 保留两位小数，权重不变时重算结果与抓取时写入的完全一致
+                score = round(float(score), 2)
+            key = (name, score_metric)
+            if values.get(key) != score:
+                values[key] = score
+                changed += 1
+        result.append((date, time, values))
+    return result, changed
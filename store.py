@@ -0,0 +1,155 @@
+import json
+import math
+import os
+import struct
+from array import array
+
+# --------------------------
+# 追加写入的快照存储
+# --------------------------
+# 文件结构：
+#   文件头  b"STKSNAP1"
+#   行组    b"RGRP" + uint32 负载长度 + 负载
+#   负载    uint32 元数据长度 + 元数据 JSON（date、time、keys，可选 status）+ float64 数组（与 keys 一一对应，缺失为 NaN）
+# 每次运行追加一个行组，写入代价与历史长度无关；尾部不完整的行组（写入中断）在读取时忽略。
+# status 为每个指数本次抓取的状态 [[名称, 指标, 状态, 错误信息, 耗时毫秒], ...]，状态为 ok / stale / failed。
+file_magic = b"STKSNAP1"
+group_magic = b"RGRP"
+group_header = struct.Struct("<4sI")
+meta_header = struct.Struct("<I")
+
+class SnapshotStore:
+    """
+    以 (date, 名称, 指标) 为键的时间序列存储。
+    一次快照为 {(名称, 指标): float 或 None}。
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path) and os.path.getsize(self.path) >= len(file_magic)
+
+    def append(self, date, values, time="", status=None):
+        """status: {(名称, 指标): (状态, 错误信息, 耗时毫秒)}，可省略"""
+        group = encode_group(date, values, time, status)
+        new_file = not self.exists()
+        with open(self.path, "ab") as f:
+            if new_file:
+                f.truncate(0)
+                f.write(file_magic)
+            f.write(group)
+
+    def replace_last(self, date, values, time="", status=None):
+        """
+        原位替换最后一个快照（refetch 修补失败项），只改写文件尾部。
+        新行组写到原行组的位置后截断；写入中断时尾部行组不完整，读取时会连同原快照一起被忽略。
+        """
+        last = self.last_offset()
+        if last is None:
+            self.append(date, values, time, status)
+            return
+        group = encode_group(date, values, time, status)
+        with open(self.path, "r+b") as f:
+            f.seek(last)
+            f.write(group)
+            f.truncate()
+
+    def rewrite(self, snapshots):
+        """用 [(date, time, values[, status]), ...] 整体替换存储内容；先写临时文件再原子替换"""
+        tmp = SnapshotStore(self.path + ".tmp")
+        if os.path.exists(tmp.path):
+            os.remove(tmp.path)
+        for date, time, values, *status in snapshots:
+            tmp.append(date, values, time=time, status=status[0] if status else None)
+        if not tmp.exists():
+            with open(tmp.path, "wb") as f:
+                f.write(file_magic)
+        os.replace(tmp.path, self.path)
+
+    def __iter__(self):
+        """按写入顺序返回 (date, time, {(名称, 指标): float 或 None})"""
+        for _, _, snapshot in self.scan():
+            yield snapshot
+
+    def scan(self, offset=None, with_status=False):
+        """
+        从文件偏移 offset（缺省为第一个行组）开始读取，返回 (行组起始偏移, 下一行组偏移, 快照)。
+        记住上次读到的偏移即可只读取之后追加的快照。with_status=True 时快照为 (date, time, values, status)。
+        """
+        if not self.exists():
+            return
+        with open(self.path, "rb") as f:
+            if f.read(len(file_magic)) != file_magic:
+                raise ValueError(f"{self.path} 不是快照文件")
+            if offset is not None:
+                f.seek(offset)
+            while True:
+                start = f.tell()
+                header = f.read(group_header.size)
+                if len(header) < group_header.size:
+                    return
+                magic, length = group_header.unpack(header)
+                payload = f.read(length)
+                if magic != group_magic or len(payload) < length:
+                    return
+                yield start, f.tell(), decode_group(payload, with_status)
+
+    def last(self):
+        last = None
+        for last in self:
+            pass
+        return last
+
+    def last_offset(self):
+        """最后一个完整行组的起始偏移；只读取各行组头，不解码负载"""
+        if not self.exists():
+            return None
+        last = None
+        size = os.path.getsize(self.path)
+        with open(self.path, "rb") as f:
+            if f.read(len(file_magic)) != file_magic:
+                raise ValueError(f"{self.path} 不是快照文件")
+            while True:
+                start = f.tell()
+                header = f.read(group_header.size)
+                if len(header) < group_header.size:
+                    return last
+                magic, length = group_header.unpack(header)
+                if magic != group_magic or f.tell() + length > size:
+                    return last
+                last = start
+                f.seek(length, os.SEEK_CUR)
+
+    def last_with_status(self):
+        """最后一个快照 (date, time, values, status)，存储为空时返回 None；没有记录状态的旧快照 status 为 {}"""
+        last = self.last_offset()
+        if last is None:
+            return None
+        for _, _, snapshot in self.scan(last, with_status=True):
+            return snapshot
+        return None
+
+def encode_group(date, values, time="", status=None):
+    keys = list(values)
+    meta = {"date": date, "time": time, "keys": [list(k) for k in keys]}
+    if status:
+        meta["status"] = [[*key, *entry] for key, entry in status.items()]
+    meta = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    data = array("d", (math.nan if values[k] is None else float(values[k]) for k in keys))
+    payload = meta_header.pack(len(meta)) + meta + data.tobytes()
+    return group_header.pack(group_magic, len(payload)) + payload
+
+def decode_group(payload, with_status=False):
+    (meta_len,) = meta_header.unpack_from(payload)
+    meta = json.loads(payload[meta_header.size:meta_header.size + meta_len].decode("utf-8"))
+    data = array("d")
+    data.frombytes(payload[meta_header.size + meta_len:])
+    values = {
+        tuple(key): (None if math.isnan(value) else value)
+        for key, value in zip(meta["keys"], data)
+    }
+    if with_status:
+        status = {(name, metric): tuple(entry) for name, metric, *entry in meta.get("status", ())}
+        return meta["date"], meta["time"], values, status
+    return meta["date"], meta["time"], values
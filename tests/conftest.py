@@ -0,0 +1,77 @@
+import json
+import os
+import sys
+
+import pytest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+fixture_dir = os.path.join(repo_dir, "tests", "fixtures")
+
+import main  # noqa: E402
+from asynchttp import Headers, Response  # noqa: E402
+
+class FakeMarket:
+    """
+    不访问网络的 transport：按代码生成确定的行情与估值响应，格式与真实接口一致。
+    failing 中的代码返回非临时性错误（不触发重试）；charts 为 False 时历史接口的响应里没有图表。
+    """
+
+    def __init__(self):
+        self.failing = set()
+        self.charts = True
+        self.requests = 0
+        self.shift = 0.0
+
+    def price(self, symbol):
+        return round(1000 + sum(map(ord, symbol)) % 997 + self.shift, 2)
+
+    def __call__(self, provider, batch, method, url, headers, body):
+        self.requests += 1
+        broken = self.failing.intersection(batch)
+        if broken:
+            raise LookupError(f"模拟失败: {sorted(broken)}")
+        if provider.name == "gtimg":
+            content = "".join(
+                f'v_{s}="1~指数~{s[-6:]}~{self.price(s)}~-1.23~-0.45~12345~678~~";\n' for s in batch
+            ).encode("gbk")
+        elif provider.name == "sina":
+            content = "".join(
+                f'var hq_str_{s}="指数,{self.price(s)},12.30,0.50,15:00:00";\n' for s in batch
+            ).encode("gbk")
+        elif provider.name == "xueqiu":
+            content = json.dumps({"data": [{"current": self.price(batch[0]), "chg": 1.0, "percent": 0.1, "volume": 100}]}).encode()
+        elif provider.name == "jiucaishuo_history":
+            data = {"top_data": []}
+            if self.charts:
+                data["chart"] = {
+                    "dates": ["2024-01-02", "2024-01-03", "2024-01-04"],
+                    "series": [
+                        {"name": "PE分位", "data": ["10.00%", "20.00%", "--"]},
+                        {"name": "PB分位", "data": ["30.00%", "40.00%", "50.00%"]},
+                    ],
+                }
+            content = json.dumps({"data": data}).encode()
+        elif provider.name == "jiucaishuo":
+            assert json.loads(body)["gu_code"] == batch[0]
+            base = sum(map(ord, batch[0])) % 90
+            top = [{"new_value": {"value": str(self.price(batch[0]))}}]
+            top += [{"new_percent_value": {"value": f"{base + i}.5%"}} for i in range(3)]
+            content = json.dumps({"data": {"top_data": top}}).encode()
+        else:
+            raise AssertionError(provider.name)
+        return Response(200, "OK", Headers(), content, url, provider.encoding)
+
+@pytest.fixture
+def market(tmp_path, monkeypatch):
+    """数据目录切到临时目录、去掉限流间隔，transport 换成 FakeMarket"""
+    fake = FakeMarket()
+    saved = main.data_dir
+    main.set_data_dir(str(tmp_path))
+    monkeypatch.setattr(main, "transport", fake)
+    monkeypatch.setattr(main, "global_throttle", main.Throttle(main.global_concurrency, 0.0))
+    for name in ("gtimg", "sina", "xueqiu", "jiucaishuo"):
+        monkeypatch.setattr(type(main.get_provider(name)), "interval", 0.0)
+    yield fake
+    main.set_data_dir(saved)
@@ -0,0 +1,148 @@
+import importlib
+import os
+import sys
+
+import openpyxl
+
+import main
+import xlsx_writer
+from replay import RecordingTransport, ReplayTransport
+from store import SnapshotStore
+
+def snapshots():
+    return list(SnapshotStore(main.store_path))
+
+def test_export_writes_store_matrix_and_workbook(market):
+    main.export_realtime_data(use_cache=False, force=True)
+    (date, _, values), = snapshots()
+    for inst in main.stocks_index:
+        provider_name, symbol = main.entry_symbol(inst)
+        assert values[(inst.name, main.metric_price)] == market.price(symbol)
+    for inst in main.pe_pb_xilv:
+        assert values[(inst.name, main.metric_score)] is not None
+
+    _, _, values, status = SnapshotStore(main.store_path).last_with_status()
+    assert {entry[0] for entry in status.values()} == {main.status_ok}
+
+    with main.open_matrix().open() as view:
+        assert view.row(-1)[2] == values
+
+    ws = openpyxl.load_workbook(main.xlsx_path).active
+    col = xlsx_writer.detect_last_col(ws)
+    assert ws.cell(row=1, column=col).value == date
+    first = main.stocks_index.instruments[0]
+    assert ws.cell(row=first.row, column=col).value == round(values[(first.name, main.metric_price)], 2)
+
+def test_unchanged_quotes_are_not_written_again(market):
+    main.export_realtime_data(use_cache=False)
+    assert main.fetch_realtime_data(use_cache=False) is None
+    assert len(snapshots()) == 1
+    market.shift = 1.0
+    assert main.fetch_realtime_data(use_cache=False) is not None
+    assert len(snapshots()) == 2
+
+def test_failed_instruments_are_missing_not_zero(market):
+    inst = main.pe_pb_xilv.instruments[0]
+    market.failing.add(main.entry_symbol(inst, main.valuation_provider)[1])
+    _, values = main.fetch_realtime_data(use_cache=False, force=True)
+    assert values[(inst.name, main.metric_score)] is None
+    _, _, _, status = SnapshotStore(main.store_path).last_with_status()
+    state, error, _ = status[(inst.name, main.metric_score)]
+    assert state == main.status_failed and "模拟失败" in error
+
+def test_recorded_responses_replay_identically(market, tmp_path):
+    fixtures = str(tmp_path / "fixtures")
+    main.transport = RecordingTransport(market, fixtures)
+    _, recorded = main.fetch_realtime_data(use_cache=False, force=True)
+    requests = market.requests
+    main.transport = ReplayTransport(fixtures)
+    _, replayed = main.fetch_realtime_data(use_cache=False, force=True)
+    assert replayed == recorded
+    assert market.requests == requests
+
+def test_backfill_without_parsed_history_writes_nothing(market):
+    market.charts = False
+    main.backfill_valuation_history()
+    assert not os.path.exists(main.history_path)
+
+def test_backfilled_scores_precede_run_history(market, capsys):
+    main.backfill_valuation_history()
+    main.export_realtime_data(use_cache=False, force=True)
+    inst = main.pe_pb_xilv.instruments[0]
+    capsys.readouterr()
+    main.print_history(inst.name)
+    dates = [line.split("\t")[0] for line in capsys.readouterr().out.splitlines()]
+    assert dates[:2] == ["2024/01/02", "2024/01/03"]
+    assert dates[2:] == [date for date, _, _ in snapshots()]
+
+def test_refetch_patches_only_failed_entries_of_todays_snapshot(market):
+    inst = main.pe_pb_xilv.instruments[0]
+    market.failing.add(main.entry_symbol(inst, main.valuation_provider)[1])
+    main.export_realtime_data(use_cache=False, force=True)
+    market.failing.clear()
+    requests = market.requests
+    main.refetch_failed(use_cache=False)
+    assert market.requests == requests + 1
+    (date, _, values), = snapshots()
+    assert values[(inst.name, main.metric_score)] is not None
+    _, _, _, status = SnapshotStore(main.store_path).last_with_status()
+    assert status[(inst.name, main.metric_score)][0] == main.status_ok
+    ws = openpyxl.load_workbook(main.xlsx_path).active
+    col = xlsx_writer.detect_last_col(ws)
+    assert ws.cell(row=inst.row, column=col).value == round(values[(inst.name, main.metric_score)], 2)
+
+def test_refetch_skips_old_or_statusless_snapshots(market):
+    inst = main.stocks_index.instruments[0]
+    key = (inst.name, main.metric_price)
+    store = SnapshotStore(main.store_path)
+    store.append("2020/01/02", {key: None}, status={key: (main.status_failed, "旧错误", 1)})
+    main.refetch_failed(use_cache=False)
+    store.append(main.datetime.now().strftime("%Y/%m/%d"), {key: None})
+    main.refetch_failed(use_cache=False)
+    assert market.requests == 0
+    assert [values[key] for _, _, values in snapshots()] == [None, None]
+
+def workbook_dates():
+    ws = openpyxl.load_workbook(main.xlsx_path).active
+    return [ws.cell(row=1, column=col).value for col in range(1, ws.max_column + 1) if ws.cell(row=1, column=col).value]
+
+def test_export_appends_each_pending_snapshot_once(market):
+    main.export_realtime_data(use_cache=False, force=True)
+    for shift in (1.0, 2.0):
+        market.shift = shift
+        main.fetch_realtime_data(use_cache=False)
+    assert main.export_pending_snapshots() == 2
+    assert main.export_pending_snapshots() == 0
+    assert workbook_dates() == [date for date, _, _ in snapshots()]
+    ws = openpyxl.load_workbook(main.xlsx_path).active
+    inst = main.stocks_index.instruments[0]
+    last_price = snapshots()[-1][2][(inst.name, main.metric_price)]
+    assert ws.cell(row=inst.row, column=xlsx_writer.detect_last_col(ws)).value == round(last_price, 2)
+
+def test_export_without_recorded_count_skips_dates_already_in_workbook(market):
+    main.fetch_realtime_data(use_cache=False, force=True)
+    wb = openpyxl.Workbook()
+    wb.active["B1"] = snapshots()[-1][0]
+    wb.save(main.xlsx_path)
+    assert main.export_pending_snapshots() == 0
+
+def test_replay_does_not_need_requests(market, tmp_path, monkeypatch):
+    fixtures = str(tmp_path / "fixtures")
+    main.transport = RecordingTransport(market, fixtures)
+    _, recorded = main.fetch_realtime_data(use_cache=False, force=True)
+    # requests 未安装时 import requests 抛出 ImportError
+    monkeypatch.setitem(sys.modules, "requests", None)
+    replay = importlib.reload(importlib.import_module("replay"))
+    main.transport = replay.ReplayTransport(fixtures)
+    _, replayed = main.fetch_realtime_data(use_cache=False, force=True)
+    assert replayed == recorded
+
+def test_history_of_name_in_both_lists_selects_metric(market, capsys):
+    main.export_realtime_data(use_cache=False, force=True)
+    name = next(inst.name for inst in main.pe_pb_xilv if inst.name in main.stocks_index)
+    (_, _, values), = snapshots()
+    for args, metric in (((name,), main.metric_price), ((name, main.metric_score), main.metric_score),
+                         ((main.status_label(name, main.metric_score),), main.metric_score)):
+        capsys.readouterr()
+        main.print_history(*args)
+        assert capsys.readouterr().out.split("\t")[1].strip() == str(round(values[(name, metric)], 2))
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from conftest import fixture_dir
+from providers import ChartFormatError, Quote, get_provider
+from replay import iter_fixtures
+
+def parse_fixtures(provider_name):
+    results = {}
+    for fixture in iter_fixtures(fixture_dir):
+        if fixture["provider"] == provider_name:
+            results.update(get_provider(provider_name).parse(fixture["body"], fixture["symbols"]))
+    return results
+
+def test_gtimg_parses_quote_fields():
+    results = parse_fixtures("gtimg")
+    assert results["s_sh000001"] == Quote(3888.08, -12.34, -0.32, 303862107.0)
+    assert results["s_sz399006"] == Quote(2980.51, 25.60, 0.87, 12345678.0)
+    # 美股指数不提供成交量
+    assert results["s_usINX"] == Quote(6715.79, -8.52, -0.13, None)
+    # 响应中没有的代码不出现在结果里，由抓取引擎记为失败
+    assert "s_sh000905" not in results
+
+def test_gtimg_name_with_tilde_trail_byte():
+    # “亊”的 GBK 编码为 0x81 0x7E，第二个字节与字段分隔符 ~ 相同
+    content = (
+        'v_s_sh600000="1~浦发亊行~600000~10.50~0.10~0.96~123~456~~";\n'
+        'v_s_sh600001="1~亊~600001~8.00~-0.20~-2.44~789~~~";\n'
+    ).encode("gbk")
+    assert b"\x81~" in content
+    assert get_provider("gtimg").parse(content, ["s_sh600000", "s_sh600001"]) == {
+        "s_sh600000": Quote(10.50, 0.10, 0.96, 123.0),
+        "s_sh600001": Quote(8.00, -0.20, -2.44, 789.0),
+    }
+
+def test_sina_parses_quotes_and_skips_empty_entries():
+    results = parse_fixtures("sina")
+    assert results["znb_SENSEX"] == Quote(81234.56, -123.45, -0.1517, None)
+    assert results["znb_NKY"] == Quote(48088.80, 1024.30, 2.18, None)
+    assert "znb_UKX" not in results
+
+def test_xueqiu_parses_json_quote():
+    assert parse_fixtures("xueqiu") == {"CSIH30455": Quote(5123.45, 26.51, 0.52, None)}
+
+def test_jiucaishuo_distinguishes_missing_from_zero():
+    results = parse_fixtures("jiucaishuo")
+    assert results["000300"] == (4640.69, 71.23, 52.10, 38.5)
+    # "--" 与空字符串为缺失，"0.00%" 是真实的 0
+    assert results["801194.SI"] == (1317.73, None, 0.0, None)
+
+def test_provider_symbols_and_batches():
+    gtimg = get_provider("gtimg")
+    assert gtimg.symbol("sh000001") == "s_sh000001"
+    assert get_provider("sina").symbol("SENSEX") == "znb_SENSEX"
+    batches = list(gtimg.batches([str(i) for i in range(130)]))
+    assert [len(b) for b in batches] == [60, 60, 10]
+
+def test_history_finds_series_by_structure():
+    chart = {
+        "xAxis": {"data": ["2024-01-02", 1704326400000, "2024-01-05"]},
+        "list": [{"name": "指数点位", "data": [3000, 3100, 3050]}, {"name": "市盈率", "data": [10, 30, 20]}],
+        "pb": [{"name": "市净率分位", "data": [["2024-01-02", "12.5%"], ["2024-01-05", "--"]]}],
+    }
+    content = json.dumps({"data": {"top_data": [], "chart": chart}}).encode()
+    # 没有百分位序列时按扩展窗口计算；与指标无关的序列忽略
+    assert get_provider("jiucaishuo_history").parse(content, ["000300"]) == {"000300": {
+        "pe": [("2024/01/02", 0.0), ("2024/01/04", 100.0), ("2024/01/05", 50.0)],
+        "pb": [("2024/01/02", 12.5)],
+    }}
+
+def test_history_unknown_format_is_an_error():
+    content = json.dumps({"data": {"top_data": []}}).encode()
+    with pytest.raises(ChartFormatError, match="top_data"):
+        get_provider("jiucaishuo_history").parse(content, ["000300"])
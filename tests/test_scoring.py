@@ -0,0 +1,33 @@
+import random
+
+import main
+from scoring import rescore_snapshots
+
+def test_rescore_reproduces_fetch_time_scores():
+    rng = random.Random(7)
+    calc_by_name = {inst.name: inst.calc for inst in main.pe_pb_xilv}
+    snapshots = []
+    for day in range(200):
+        values = {}
+        for inst in main.pe_pb_xilv:
+            components = tuple(round(rng.uniform(0, 100), 2) for _ in main.component_metrics)
+            values.update(zip(((inst.name, m) for m in main.component_metrics), components))
+            values[(inst.name, main.metric_score)] = main.calc_valuation_score(components, inst.calc)
+        snapshots.append((f"2025/01/{day:03d}", "", values))
+    rescored, changed = rescore_snapshots(snapshots, calc_by_name, score_metric=main.metric_score)
+    assert changed == 0
+    assert [values for _, _, values in rescored] == [values for _, _, values in snapshots]
+
+def test_rescore_keeps_scores_without_components():
+    name = main.pe_pb_xilv.instruments[0].name
+    snapshots = [("2025/01/01", "", {(name, main.metric_score): 42.0})]
+    rescored, changed = rescore_snapshots(snapshots, {name: (0.5, 0.5, 0)}, score_metric=main.metric_score)
+    assert changed == 0 and rescored[0][2][(name, main.metric_score)] == 42.0
+
+def test_rescore_clears_scores_missing_a_weighted_component():
+    name = main.pe_pb_xilv.instruments[0].name
+    values = {(name, "pe"): 40.0, (name, "pb"): 60.0, (name, "xilv"): None, (name, main.metric_score): 50.0}
+    rescored, changed = rescore_snapshots(
+        [("2025/01/01", "", values)], {name: (0.3, 0.3, 0.4)}, score_metric=main.metric_score)
+    assert changed == 1 and rescored[0][2][(name, main.metric_score)] is None
+    assert main.calc_valuation_score((40.0, 60.0, None), (0.3, 0.3, 0.4)) is None
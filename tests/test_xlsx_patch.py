@@ -0,0 +1,98 @@
+import shutil
+import zipfile
+
+import openpyxl
+import pytest
+
+import xlsx_writer
+from xlsx_patch import (
+    PatchUnsupported, append_column_in_place, column_index, column_letter, patch_column_in_place,
+)
+
+layout = [(3, ("甲", "price")), (4, ("乙", "price")), (6, ("丙", "score")), (7, ("丙", "point"))]
+styles = (xlsx_writer.cell_style_name, xlsx_writer.number_style_name, xlsx_writer.header_style_name)
+history = [
+    ("2025/10/23", "", {("甲", "price"): 3888.081, ("乙", "price"): None, ("丙", "score"): 54.0, ("丙", "point"): 1317.7}),
+    ("2025/10/27", "", {("甲", "price"): 3901.5, ("乙", "price"): 2980.51, ("丙", "score"): 55.25, ("丙", "point"): 1320.0}),
+]
+new_values = {("甲", "price"): 3912.345, ("乙", "price"): None, ("丙", "score"): 56.0, ("丙", "point"): 1333.3}
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = str(tmp_path / "base.xlsx")
+    xlsx_writer.write_xlsx_streaming(path, history, layout, last_col_name=xlsx_writer.last_col_name)
+    return path
+
+def sheet_cells(path):
+    ws = openpyxl.load_workbook(path).active
+    return {
+        (cell.row, cell.column): (cell.value, cell.style)
+        for row in ws.iter_rows() for cell in row if cell.value is not None
+    }
+
+def test_column_letters_round_trip():
+    for index in (1, 26, 27, 52, 702, 703, 16384):
+        assert column_index(column_letter(index)) == index
+    assert column_letter(28) == "AB"
+
+def test_append_matches_openpyxl(workbook, tmp_path):
+    expected = str(tmp_path / "expected.xlsx")
+    shutil.copy(workbook, expected)
+    xlsx_writer.append_column(expected, "2025/10/30", new_values, layout)
+
+    col = append_column_in_place(
+        workbook, "2025/10/30", new_values, layout, "上证", styles, xlsx_writer.column_width, xlsx_writer.last_col_name)
+    assert col == 3
+    assert sheet_cells(workbook) == sheet_cells(expected)
+    wb = openpyxl.load_workbook(workbook)
+    assert xlsx_writer.read_last_col_index(wb.active) == 3
+    assert wb.active.column_dimensions["C"].width == xlsx_writer.column_width
+
+def test_untouched_members_are_copied_verbatim(workbook):
+    with zipfile.ZipFile(workbook) as zf:
+        before = {info.filename: zf.read(info) for info in zf.infolist()}
+    append_column_in_place(
+        workbook, "2025/10/30", new_values, layout, "上证", styles, xlsx_writer.column_width, xlsx_writer.last_col_name)
+    with zipfile.ZipFile(workbook) as zf:
+        assert zf.testzip() is None
+        after = {info.filename: zf.read(info) for info in zf.infolist()}
+    assert list(after) == list(before)
+    changed = {name for name in before if before[name] != after[name]}
+    assert changed == {"xl/workbook.xml", "xl/worksheets/sheet1.xml"}
+
+def test_append_requires_named_styles(tmp_path):
+    path = str(tmp_path / "plain.xlsx")
+    wb = openpyxl.Workbook()
+    wb.active["A1"] = "2025/10/23"
+    wb.save(path)
+    with pytest.raises(PatchUnsupported):
+        append_column_in_place(
+            path, "2025/10/30", new_values, layout, "上证", styles, xlsx_writer.column_width, xlsx_writer.last_col_name)
+
+def test_patch_replaces_only_given_cells_in_last_column(workbook):
+    before = sheet_cells(workbook)
+    col = patch_column_in_place(
+        workbook, "2025/10/27", {("乙", "price"): 2999.994}, layout, xlsx_writer.number_style_name, xlsx_writer.column_width)
+    assert col == 2
+    after = sheet_cells(workbook)
+    assert after.pop((4, 2)) == (2999.99, xlsx_writer.number_style_name)
+    before.pop((4, 2))
+    assert after == before
+
+def test_patch_fills_missing_cell(workbook):
+    # 第 1 列第 4 行原本为空；先追加一列，把它变成最后一列再修补
+    append_column_in_place(
+        workbook, "2025/10/30", new_values, layout, "上证", styles, xlsx_writer.column_width, xlsx_writer.last_col_name)
+    patch_column_in_place(
+        workbook, "2025/10/30", {("乙", "price"): 2990.0}, layout, xlsx_writer.number_style_name, xlsx_writer.column_width)
+    ws = openpyxl.load_workbook(workbook).active
+    assert ws.cell(row=4, column=3).value == 2990.0
+    assert ws.cell(row=3, column=3).value == round(new_values[("甲", "price")], 2)
+
+def test_patch_skips_when_last_column_is_another_date(workbook):
+    with open(workbook, "rb") as f:
+        before = f.read()
+    assert patch_column_in_place(
+        workbook, "2025/10/23", {("乙", "price"): 1.0}, layout, xlsx_writer.number_style_name, xlsx_writer.column_width) is None
+    with open(workbook, "rb") as f:
+        assert f.read() == before
@@ -0,0 +1,47 @@
+import json
+from datetime import date, datetime, timedelta, timezone
+
+# --------------------------
+# 交易日历
+# --------------------------
+# 休市日保存在 trading_calendar.json（按市场、按年份），只列出落在工作日的休市日。
+# 某市场某年份未列出时只跳过周末，并在 uncovered 中记下，由调用方提示补充。
+beijing_tz = timezone(timedelta(hours=8))
+
+class TradingCalendar:
+    def __init__(self, markets):
+        """markets: {市场: (北京时间当天对应交易日的偏移天数, {年份: {休市日 date, ...}})}"""
+        self.markets = markets
+        self.uncovered = set()
+
+    def is_trading_day(self, market, day):
+        if day.weekday() >= 5:
+            return False
+        _, holidays = self.markets[market]
+        year_holidays = holidays.get(day.year)
+        if year_holidays is None:
+            self.uncovered.add((market, day.year))
+            return True
+        return day not in year_holidays
+
+    def session_day(self, market, now=None):
+        """北京时间 now 对应的该市场交易日（美股为前一天的交易时段）"""
+        offset, _ = self.markets[market]
+        now = (now or datetime.now(beijing_tz)).astimezone(beijing_tz)
+        return now.date() + timedelta(days=offset)
+
+    def open_markets(self, now=None):
+        """北京时间 now 对应的交易日仍在交易的市场列表"""
+        return [market for market in self.markets if self.is_trading_day(market, self.session_day(market, now))]
+
+def load_calendar(path):
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    markets = {}
+    for market, entry in config["markets"].items():
+        holidays = {
+            int(year): {date.fromisoformat(day) for day in days}
+            for year, days in entry.get("holidays", {}).items()
+        }
+        markets[market] = (entry.get("session_offset_days", 0), holidays)
+    return TradingCalendar(markets)
@@ -0,0 +1,353 @@
+import math
+import os
+import posixpath
+import re
+import struct
+import zipfile
+import zlib
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, unescape
+
+# --------------------------
+# 就地追加一列
+# --------------------------
+# 不经过 openpyxl 的单元格对象模型：只改写活动工作表的 XML（按字符串在每个 <row> 末尾追加 <c>，
+# 更新 <dimension> 与 <cols>）和 workbook.xml 中记录最后一列的定义名称，
+# 其余 zip 成员按原始压缩字节逐字节复制，不解压也不重新压缩。
+# 单元格样式引用工作簿中已注册的命名样式（xlsx_writer 中的 stocks_*）；找不到时抛出 PatchUnsupported，
+# 由调用方退回 openpyxl 的完整读写。refetch 修补失败项时用同样的方式改写最后一列中的个别单元格。
+main_ns = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+rel_ns = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+pkg_rel_ns = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+local_header = struct.Struct("<4s2B4HL2L2H")
+central_header = struct.Struct("<4s4B4HL2L5H2L")
+end_record = struct.Struct("<4s4H2LH")
+utf8_flag = 0x800
+descriptor_flag = 0x08
+
+class PatchUnsupported(Exception):
+    pass
+
+# ---------- 坐标 ----------
+def column_letter(index):
+    letters = ""
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def column_index(letters):
+    index = 0
+    for ch in letters:
+        index = index * 26 + ord(ch) - 64
+    return index
+
+cell_ref = re.compile(r'<c r="([A-Z]+)(\d+)"')
+row_number = re.compile(r'\br="(\d+)"')
+
+# ---------- 工作簿结构 ----------
+def active_sheet(zf):
+    """返回 (工作表标题, 工作表 XML 在 zip 中的路径)"""
+    workbook = ElementTree.fromstring(zf.read("xl/workbook.xml"))
+    view = workbook.find(f"{{{main_ns}}}bookViews/{{{main_ns}}}workbookView")
+    active = int(view.get("activeTab", 0)) if view is not None else 0
+    sheets = workbook.findall(f"{{{main_ns}}}sheets/{{{main_ns}}}sheet")
+    if active >= len(sheets):
+        raise PatchUnsupported("找不到活动工作表")
+    sheet = sheets[active]
+    rels = ElementTree.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    rid = sheet.get(f"{{{rel_ns}}}id")
+    for rel in rels.findall(f"{{{pkg_rel_ns}}}Relationship"):
+        if rel.get("Id") == rid:
+            target = rel.get("Target")
+            path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+            return sheet.get("name"), path
+    raise PatchUnsupported("找不到活动工作表")
+
+def style_indexes(zf, names):
+    """命名样式名 -> cellXfs 中引用它的第一个 xf 的序号（单元格 s 属性）"""
+    styles = ElementTree.fromstring(zf.read("xl/styles.xml"))
+    xf_ids = {
+        style.get("name"): style.get("xfId")
+        for style in styles.findall(f"{{{main_ns}}}cellStyles/{{{main_ns}}}cellStyle")
+    }
+    cell_xfs = styles.findall(f"{{{main_ns}}}cellXfs/{{{main_ns}}}xf")
+    indexes = {}
+    for name in names:
+        xf_id = xf_ids.get(name)
+        index = next((i for i, xf in enumerate(cell_xfs) if xf_id is not None and xf.get("xfId") == xf_id), None)
+        if index is None:
+            raise PatchUnsupported(f"工作簿中没有命名样式 {name}")
+        indexes[name] = index
+    return indexes
+
+# ---------- 单元格 ----------
+def string_cell(ref, text, style):
+    return f'<c r="{ref}" s="{style}" t="inlineStr"><is><t>{escape(str(text))}</t></is></c>'
+
+def number_cell(ref, value, style):
+    return f'<c r="{ref}" s="{style}" t="n"><v>{round(float(value), 2)!r}</v></c>'
+
+def append_cells(row_xml, cells):
+    row_xml = re.sub(r'\sspans="[^"]*"', "", row_xml, count=1)
+    if row_xml.endswith("/>"):
+        return row_xml[:-2].rstrip() + ">" + cells + "</row>"
+    return row_xml[:-len("</row>")] + cells + "</row>"
+
+# ---------- 工作表 XML ----------
+def iter_rows(body):
+    """按 str.find 定位每个 <row> 元素，返回 (起, 止)；单元格内容中不会出现 <row"""
+    pos = 0
+    while True:
+        start = body.find("<row", pos)
+        if start < 0:
+            return
+        tag_end = body.index(">", start)
+        end = tag_end + 1 if body[tag_end - 1] == "/" else body.index("</row>", tag_end) + len("</row>")
+        yield start, end
+        pos = end
+
+def patch_sheet(xml, new_cells, col, width, replace=False):
+    """
+    new_cells: {行号: 单元格 XML}，均位于第 col 列。
+    返回改写后的 XML；任何一行已有第 col 列或其右侧的单元格时抛出 PatchUnsupported。
+    replace=True 时该行最后一个单元格正是第 col 列则替换它。
+    """
+    start = xml.find("<sheetData")
+    end = xml.find("</sheetData>")
+    if start < 0:
+        raise PatchUnsupported("工作表中没有 sheetData")
+    if end < 0:
+        # <sheetData/> 空表
+        open_end = xml.index("/>", start) + 2
+        head, body, tail = xml[:start] + "<sheetData>", "", "</sheetData>" + xml[open_end:]
+    else:
+        open_end = xml.index(">", start) + 1
+        head, body, tail = xml[:open_end], xml[open_end:end], xml[end:]
+
+    pending = dict(new_cells)
+    max_col = col
+    max_row = max(pending, default=1)
+    parts = []
+    pos = 0
+    for row_start, row_end in iter_rows(body):
+        parts.append(body[pos:row_start])
+        pos = row_end
+        row_xml = body[row_start:row_end]
+        row = int(row_number.search(row_xml).group(1))
+        max_row = max(max_row, row)
+        # 行内单元格按列递增排列，只需检查最后一个
+        last = cell_ref.match(row_xml, row_xml.rfind("<c "))
+        if last:
+            existing = column_index(last.group(1))
+            if existing == col and replace and row in pending:
+                row_xml = row_xml[:last.start()] + "</row>"
+            elif existing >= col and row in pending:
+                raise PatchUnsupported(f"第 {row} 行已有第 {col} 列或其右侧的单元格")
+            max_col = max(max_col, existing)
+        # 表中没有的行按行号顺序插入到当前行之前
+        for missing in sorted(r for r in pending if r < row):
+            parts.append(f'<row r="{missing}">{pending.pop(missing)}</row>')
+        if row in pending:
+            row_xml = append_cells(row_xml, pending.pop(row))
+        parts.append(row_xml)
+    parts.append(body[pos:])
+    for missing in sorted(pending):
+        parts.append(f'<row r="{missing}">{pending.pop(missing)}</row>')
+    xml = head + "".join(parts) + tail
+
+    ref = f"A1:{column_letter(max_col)}{max_row}"
+    if "<dimension" in xml:
+        xml = re.sub(r'<dimension ref="[^"]*"\s*/>', f'<dimension ref="{ref}" />', xml, count=1)
+    else:
+        xml = xml.replace("<sheetViews", f'<dimension ref="{ref}" /><sheetViews', 1) if "<sheetViews" in xml else xml
+
+    new_col = f'<col min="{col}" max="{col}" width="{width}" customWidth="1" />'
+    covered = any(
+        int(a) <= col <= int(b)
+        for a, b in re.findall(r'<col\b[^>]*?min="(\d+)"[^>]*?max="(\d+)"', xml)
+    )
+    if not covered:
+        if "</cols>" in xml:
+            xml = xml.replace("</cols>", new_col + "</cols>", 1)
+        else:
+            xml = xml.replace("<sheetData", f"<cols>{new_col}</cols><sheetData", 1)
+    return xml
+
+def last_column(xml):
+    """第 1 行（日期表头）中最右侧单元格的列号，空表为 0"""
+    m = re.search(r'<row\b[^>]*?\br="1"[^>]*?(?:/>|>(.*?)</row>)', xml, re.S)
+    if not m or not m.group(1):
+        return 0
+    last = cell_ref.match(m.group(1), m.group(1).rfind("<c "))
+    return column_index(last.group(1)) if last else 0
+
+def header_text(zf, xml, col):
+    """第 1 行第 col 列单元格的文本（共享字符串、内联字符串或数值），没有时返回 None"""
+    m = re.search(rf'<c r="{column_letter(col)}1"[^>]*?(?:/>|>.*?</c>)', xml, re.S)
+    if not m:
+        return None
+    cell = ElementTree.fromstring(m.group(0))
+    texts = "".join(el.text or "" for el in cell.iter() if el.tag.rsplit("}", 1)[-1] in ("t", "v"))
+    if cell.get("t") != "s":
+        return texts
+    shared = ElementTree.fromstring(zf.read("xl/sharedStrings.xml"))
+    item = shared.findall(f"{{{main_ns}}}si")[int(texts)]
+    return "".join(el.text or "" for el in item.iter(f"{{{main_ns}}}t"))
+
+def defined_name_pattern(name):
+    return re.compile(rf'(<definedName\b[^>]*\bname="{re.escape(name)}"[^>]*>)([^<]*)(</definedName>)')
+
+def defined_name_text(xml, name):
+    """workbook.xml 中定义名称的值，没有时返回 None"""
+    m = defined_name_pattern(name).search(xml)
+    return unescape(m.group(2)) if m else None
+
+def patch_defined_name(xml, name, title, col):
+    return set_defined_name(xml, name, f"'{title}'!${column_letter(col)}$1")
+
+def set_defined_name(xml, name, target):
+    pattern = defined_name_pattern(name)
+    if pattern.search(xml):
+        return pattern.sub(lambda m: m.group(1) + escape(target) + m.group(3), xml, count=1)
+    entry = f'<definedName name="{name}">{escape(target)}</definedName>'
+    if "</definedNames>" in xml:
+        return xml.replace("</definedNames>", entry + "</definedNames>", 1)
+    for anchor in ("<calcPr", "</workbook>"):
+        if anchor in xml:
+            return xml.replace(anchor, f"<definedNames>{entry}</definedNames>{anchor}", 1)
+    return xml
+
+# ---------- zip ----------
+def dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+def rewrite_zip(src_path, dst_path, replacements):
+    """
+    按原顺序写出新的 zip：replacements 中的成员用新内容重新压缩，
+    其余成员直接复制原始压缩数据（不解压、不重新压缩）。
+    """
+    with zipfile.ZipFile(src_path) as zf, open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        central = []
+        for info in zf.infolist():
+            name = info.filename.encode("utf-8" if info.flag_bits & utf8_flag else "cp437")
+            flags = info.flag_bits & ~descriptor_flag
+            if info.filename in replacements:
+                data = replacements[info.filename]
+                compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+                raw = compressor.compress(data) + compressor.flush()
+                crc, size, method = zlib.crc32(data), len(data), zipfile.ZIP_DEFLATED
+            else:
+                src.seek(info.header_offset)
+                fields = local_header.unpack(src.read(local_header.size))
+                src.seek(fields[-2] + fields[-1], os.SEEK_CUR)
+                raw = src.read(info.compress_size)
+                crc, size, method = info.CRC, info.file_size, info.compress_type
+            if max(len(raw), size, dst.tell()) >= 0xFFFFFFFF:
+                raise PatchUnsupported("不支持 zip64")
+            mtime, mdate = dos_datetime(info.date_time)
+            offset = dst.tell()
+            dst.write(local_header.pack(
+                b"PK\x03\x04", info.extract_version, 0, flags, method, mtime, mdate,
+                crc, len(raw), size, len(name), 0))
+            dst.write(name)
+            dst.write(raw)
+            central.append(central_header.pack(
+                b"PK\x01\x02", info.create_version, info.create_system, info.extract_version, 0,
+                flags, method, mtime, mdate, crc, len(raw), size,
+                len(name), 0, len(info.comment), 0, info.internal_attr, info.external_attr, offset,
+            ) + name + info.comment)
+        directory_offset = dst.tell()
+        directory = b"".join(central)
+        dst.write(directory)
+        dst.write(end_record.pack(b"PK\x05\x06", 0, 0, len(central), len(central), len(directory), directory_offset, 0))
+
+def export_state(xlsx_path, exported_name):
+    """返回 (定义名称 exported_name 记录的已导出快照数或 None, 最后一列的日期表头或 None)"""
+    with zipfile.ZipFile(xlsx_path) as zf:
+        _, sheet_path = active_sheet(zf)
+        workbook_xml = zf.read("xl/workbook.xml").decode("utf-8")
+        sheet_xml = zf.read(sheet_path).decode("utf-8")
+        col = last_column(sheet_xml)
+        header = header_text(zf, sheet_xml, col) if col else None
+    count = defined_name_text(workbook_xml, exported_name)
+    return (int(count) if count and count.isdigit() else None), header
+
+def append_column_in_place(xlsx_path, date, values, layout, header, styles, width, last_col_name, counters=None):
+    """
+    在活动工作表最后一列之后追加一列：第 1 行日期、第 2 行表头、其余按 layout 写入数值。
+    styles 为 (普通, 数值, 表头) 三个命名样式名；counters 为 {定义名称: 整数}，一并写入 workbook.xml。
+    写临时文件后原子替换，返回写入的列号。
+    """
+    cell_style, number_style, header_style = styles
+    with zipfile.ZipFile(xlsx_path) as zf:
+        title, sheet_path = active_sheet(zf)
+        indexes = style_indexes(zf, styles)
+        sheet_xml = zf.read(sheet_path).decode("utf-8")
+        workbook_xml = zf.read("xl/workbook.xml").decode("utf-8")
+
+    col = last_column(sheet_xml) + 1
+    letters = column_letter(col)
+    cells = {
+        1: string_cell(f"{letters}1", date, indexes[cell_style]),
+        2: string_cell(f"{letters}2", header, indexes[header_style]),
+    }
+    for row, key in layout:
+        value = values.get(key)
+        if value is None or row in (1, 2) or (isinstance(value, float) and math.isnan(value)):
+            continue
+        # 同一行后写入的覆盖先写入的
+        cells[row] = number_cell(f"{letters}{row}", value, indexes[number_style])
+
+    workbook_xml = patch_defined_name(workbook_xml, last_col_name, title, col)
+    for name, count in (counters or {}).items():
+        workbook_xml = set_defined_name(workbook_xml, name, str(count))
+    replacements = {
+        sheet_path: patch_sheet(sheet_xml, cells, col, width).encode("utf-8"),
+        "xl/workbook.xml": workbook_xml.encode("utf-8"),
+    }
+    tmp = xlsx_path + ".tmp"
+    try:
+        rewrite_zip(xlsx_path, tmp, replacements)
+        os.replace(tmp, xlsx_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return col
+
+def patch_column_in_place(xlsx_path, date, values, layout, number_style, width):
+    """
+    改写活动工作表最后一列中 values 涉及的数值单元格（refetch 修补失败项），其余单元格保持不变。
+    最后一列的日期表头不是 date 时不改动文件并返回 None，否则返回改写的列号。
+    """
+    with zipfile.ZipFile(xlsx_path) as zf:
+        _, sheet_path = active_sheet(zf)
+        style = style_indexes(zf, (number_style,))[number_style]
+        sheet_xml = zf.read(sheet_path).decode("utf-8")
+        col = last_column(sheet_xml)
+        if not col or header_text(zf, sheet_xml, col) != date:
+            return None
+
+    letters = column_letter(col)
+    # 同一行后写入的覆盖先写入的：只改写最终显示的是 values 中键的那些行
+    row_keys = {row: key for row, key in layout if row not in (1, 2)}
+    cells = {}
+    for row, key in row_keys.items():
+        value = values.get(key)
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            continue
+        cells[row] = number_cell(f"{letters}{row}", value, style)
+    if not cells:
+        return col
+
+    replacements = {sheet_path: patch_sheet(sheet_xml, cells, col, width, replace=True).encode("utf-8")}
+    tmp = xlsx_path + ".tmp"
+    try:
+        rewrite_zip(xlsx_path, tmp, replacements)
+        os.replace(tmp, xlsx_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return col
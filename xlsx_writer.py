@@ -0,0 +1,267 @@
+import math
+import os
+from array import array
+from datetime import datetime
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle
+from openpyxl.utils import absolute_coordinate, column_index_from_string, get_column_letter, quote_sheetname
+from openpyxl.workbook.defined_name import DefinedName
+from openpyxl.worksheet.dimensions import ColumnDimension
+
+from metrics import run_metrics
+
+# --------------------------
+# 共享命名样式
+# --------------------------
+# 整张表只有三种样式，注册为命名样式后每个单元格只引用名称，样式表大小与列数无关
+cell_style_name = "stocks_cell"
+number_style_name = "stocks_number"
+header_style_name = "stocks_header"
+column_width = 15
+
+def named_styles():
+    alignment = Alignment(horizontal="center", vertical="center")
+    return [
+        NamedStyle(cell_style_name, font=Font(name="宋体", size=12), alignment=alignment),
+        NamedStyle(number_style_name, font=Font(name="宋体", size=12), alignment=alignment, number_format="0.00"),
+        NamedStyle(header_style_name, font=Font(name="宋体", size=12, bold=True), alignment=alignment),
+    ]
+
+def register_named_styles(wb):
+    existing = set(wb.named_styles)
+    for style in named_styles():
+        if style.name not in existing:
+            wb.add_named_style(style)
+
+# --------------------------
+# 流式导出
+# --------------------------
+def collect_rows(snapshots, layout):
+    """
+    snapshots: 可迭代的 (date, time, {(名称, 指标): float 或 None})
+    layout: [(行号, (名称, 指标)), ...]，同一行后写入的非空值覆盖先写入的
+    返回 (日期列表, {行号: array('d')})，缺失值为 NaN；只保存数值，不创建单元格对象。
+    """
+    row_keys = {}
+    for row, key in layout:
+        row_keys.setdefault(row, []).append(key)
+    dates = []
+    rows = {row: array("d") for row in row_keys}
+    for date, _, values in snapshots:
+        dates.append(date)
+        for row, keys in row_keys.items():
+            value = None
+            for key in keys:
+                if values.get(key) is not None:
+                    value = values[key]
+            rows[row].append(math.nan if value is None else value)
+    return dates, rows
+
+def styled_cell(ws, value, style):
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
+
+def write_xlsx_streaming(path, snapshots, layout, title="StockData", header="上证", last_col_name=None,
+                         exported_name=None):
+    """
+    以 write_only 模式重建工作簿：第 1 行日期，第 2 行表头，其余行按 layout 填入数值。
+    按行流式写出，内存只与数值矩阵有关，不随单元格对象和样式增长。
+    指定 exported_name 时把写入的快照数记在该定义名称中。
+    """
+    dates, rows = collect_rows(snapshots, layout)
+    wb = openpyxl.Workbook(write_only=True)
+    register_named_styles(wb)
+    ws = wb.create_sheet(title)
+    if dates:
+        ws.column_dimensions["A"] = ColumnDimension(ws, min=1, max=len(dates), width=column_width)
+
+    ws.append([styled_cell(ws, date, cell_style_name) for date in dates])
+    ws.append([styled_cell(ws, header, header_style_name) for _ in dates])
+    max_row = max(rows, default=2)
+    for row in range(3, max_row + 1):
+        values = rows.get(row)
+        if values is None:
+            ws.append([])
+            continue
+        ws.append([
+            None if math.isnan(value) else styled_cell(ws, round(value, 2), number_style_name)
+            for value in values
+        ])
+
+    if last_col_name and dates:
+        coord = absolute_coordinate(f"{get_column_letter(len(dates))}1")
+        wb.defined_names[last_col_name] = DefinedName(last_col_name, attr_text=f"{quote_sheetname(title)}!{coord}")
+    if exported_name:
+        wb.defined_names[exported_name] = DefinedName(exported_name, attr_text=str(len(dates)))
+    wb.save(path)
+
+def write_tables_xlsx(path, sheets):
+    """
+    以 write_only 模式写出若干张表：sheets 为 [(表名, 表头, 行), ...]，
+    数值保留两位小数，None 留空。
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    register_named_styles(wb)
+    for title, header, rows in sheets:
+        ws = wb.create_sheet(title)
+        ws.column_dimensions["A"] = ColumnDimension(ws, min=1, max=len(header), width=column_width)
+        ws.append([styled_cell(ws, name, header_style_name) for name in header])
+        for row in rows:
+            ws.append([
+                None if value is None
+                else styled_cell(ws, round(value, 2), number_style_name) if isinstance(value, float)
+                else styled_cell(ws, value, cell_style_name)
+                for value in row
+            ])
+    wb.save(path)
+
+# --------------------------
+# 追加写入
+# --------------------------
+# 记录最后写入列的工作簿定义名称，指向该列的表头单元格
+last_col_name = "stocks_last_col"
+# 记录已导出到工作簿的快照数（快照存储中的前若干个）的定义名称，值为整数常量
+exported_name = "stocks_exported"
+
+def is_empty(value):
+    return value is None or value == ""
+
+def read_last_col_index(ws):
+    defn = ws.parent.defined_names.get(last_col_name)
+    if defn is None:
+        return None
+    for sheet, coord in defn.destinations:
+        if sheet != ws.title:
+            continue
+        try:
+            return column_index_from_string(coord.replace("$", "").rstrip("0123456789"))
+        except ValueError:
+            return None
+    return None
+
+def save_last_col_index(ws, col):
+    coord = absolute_coordinate(f"{get_column_letter(col)}1")
+    ws.parent.defined_names[last_col_name] = DefinedName(last_col_name, attr_text=f"{quote_sheetname(ws.title)}!{coord}")
+
+def save_exported_count(wb, count):
+    wb.defined_names[exported_name] = DefinedName(exported_name, attr_text=str(count))
+
+def detect_last_col(ws):
+    """
+    返回最后一个已写入的列号。
+    优先读取工作簿中记录的索引（只校验两个表头单元格）；索引缺失或失效时，
+    从右向左只扫描第 1 行（日期表头）。
+    """
+    col = read_last_col_index(ws)
+    if col and not is_empty(ws.cell(row=1, column=col).value) and is_empty(ws.cell(row=1, column=col + 1).value):
+        return col
+    for col in range(ws.max_column, 0, -1):
+        if not is_empty(ws.cell(row=1, column=col).value):
+            return col
+    return 1
+
+def set_column_style(ws, col_idx):
+    # 单元格只引用工作簿级的命名样式；列宽只设置新列，历史列保持不动
+    register_named_styles(ws.parent)
+    for row in ws.iter_rows(min_col=col_idx, max_col=col_idx, min_row=1, max_row=ws.max_row):
+        for cell in row:
+            cell.style = number_style_name if isinstance(cell.value, (int, float)) else cell_style_name
+    ws.cell(row=2, column=col_idx).style = header_style_name
+    ws.column_dimensions[get_column_letter(col_idx)].width = column_width
+
+def safe_float_convert(val):
+    try:
+        return round(float(val), 2)
+    except Exception:
+        return val
+
+def write_number_cell(ws, row, col, value):
+    if isinstance(value, (int, float)):
+        rounded = round(float(value), 2)
+        ws.cell(row=row, column=col, value=rounded)
+        ws.cell(row=row, column=col).number_format = '0.00'
+    else:
+        ws.cell(row=row, column=col, value=value)
+
+def write_snapshot_to_ws(ws, col, date, values, layout, header="上证"):
+    ws.cell(row=1, column=col, value=date)
+    ws.cell(row=2, column=col, value=header)
+    for row, key in layout:
+        value = values.get(key)
+        if value is not None:
+            # 写入浮点并限制两位小数
+            write_number_cell(ws, row, col, value)
+
+def read_xlsx_columns(xlsx_path, layout):
+    """按列读取现有工作簿，返回 [(date, {(名称, 指标): float 或 None}), ...]，跳过没有日期的列"""
+    wb = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
+    rows = [list(r) for r in wb.active.iter_rows(values_only=True)]
+    wb.close()
+    row_keys = dict(layout)
+    width = max((len(r) for r in rows), default=0)
+    columns = []
+    for col in range(width):
+        date = rows[0][col] if rows and col < len(rows[0]) else None
+        if is_empty(date):
+            continue
+        values = {}
+        for row, key in row_keys.items():
+            cell = rows[row - 1][col] if row - 1 < len(rows) and col < len(rows[row - 1]) else None
+            values[key] = cell if isinstance(cell, (int, float)) else None
+        if isinstance(date, datetime):
+            date = date.strftime("%Y/%m/%d")
+        columns.append((str(date), values))
+    return columns
+
+def append_column(xlsx_path, date, values, layout, title="StockData", exported=None):
+    """追加一列；exported 不为 None 时同时记下已导出的快照数"""
+    with run_metrics.stage("load_workbook"):
+        if not os.path.exists(xlsx_path):
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.title = title
+        else:
+            wb = openpyxl.load_workbook(xlsx_path)
+            ws = wb.active
+
+    with run_metrics.stage("detect_last_col"):
+        last_col = detect_last_col(ws)
+    target_col = last_col + 1
+
+    with run_metrics.stage("write_column"):
+        write_snapshot_to_ws(ws, target_col, date, values, layout)
+    with run_metrics.stage("set_column_style"):
+        set_column_style(ws, target_col)
+    save_last_col_index(ws, target_col)
+    if exported is not None:
+        save_exported_count(wb, exported)
+
+    with run_metrics.stage("save_workbook"):
+        wb.save(xlsx_path)
+
+def patch_column(xlsx_path, date, values, layout):
+    """
+    改写最后一列中 values 涉及的数值单元格（refetch 修补失败项）。
+    最后一列的日期表头不是 date 时不改动文件并返回 None，否则返回改写的列号。
+    """
+    wb = openpyxl.load_workbook(xlsx_path)
+    ws = wb.active
+    col = detect_last_col(ws)
+    header = ws.cell(row=1, column=col).value
+    if isinstance(header, datetime):
+        header = header.strftime("%Y/%m/%d")
+    if is_empty(header) or str(header) != date:
+        return None
+    register_named_styles(wb)
+    # 同一行后写入的覆盖先写入的：只改写最终显示的是 values 中键的那些行
+    row_keys = {row: key for row, key in layout if row not in (1, 2)}
+    for row, key in row_keys.items():
+        value = values.get(key)
+        if value is not None:
+            write_number_cell(ws, row, col, value)
+            ws.cell(row=row, column=col).style = number_style_name
+    wb.save(xlsx_path)
+    return col